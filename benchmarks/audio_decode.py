@@ -0,0 +1,63 @@
+"""
+Time audio_file_to_tensor one file at a time, and a batch decoded by a thread pool like the producer's decode_pool at
+several worker counts, tests/test_audio.py checks what it returns
+
+Usage: python -m benchmarks.audio_decode [files...] [--workers 1 4 8]  (defaults to test-files/*.m4a)
+"""
+
+import argparse
+import glob
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+from src.audio import audio_file_to_tensor
+
+
+def _time(fn: Callable, files: List[str], repeats: int) -> Tuple[List[float], float]:
+    latencies = []
+    audio_seconds = 0.0
+    for _ in range(repeats):
+        for fname in files:
+            start = time.perf_counter()
+            _, duration = fn(fname)
+            latencies.append(time.perf_counter() - start)
+            audio_seconds += duration
+    return latencies, audio_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 4, 8])
+    args = parser.parse_args()
+    files = args.files or sorted(glob.glob('test-files/*.m4a'))
+
+    # warm up the page cache
+    audio_file_to_tensor(files[0])
+    latencies, audio_seconds = _time(audio_file_to_tensor, files, args.repeats)
+    print(
+        f"one at a time: {audio_seconds / sum(latencies):8.1f} audio-s/s, "
+        f"p50 {statistics.median(latencies) * 1000:7.1f}ms, max {max(latencies) * 1000:7.1f}ms"
+    )
+
+    # a batch of many short segments, as the producer gets them
+    batch = files * args.repeats
+    for workers in args.workers:
+        # one long-lived pool, the way ASRProducer keeps its decode_pool
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            futures = [pool.submit(audio_file_to_tensor, fname) for fname in batch]
+            failed = sum(f.exception() is not None for f in futures)
+            elapsed = time.perf_counter() - start
+        audio_seconds = sum(f.result()[1] for f in futures if f.exception() is None)
+        print(
+            f"batch of {len(batch)} with {workers} workers: {elapsed * 1000:7.1f}ms, "
+            f"{audio_seconds / elapsed:8.1f} audio-s/s, {failed} failed"
+        )
+
+
+if __name__ == '__main__':
+    main()
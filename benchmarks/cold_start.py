@@ -0,0 +1,68 @@
+"""
+Startup breakdown of a fresh process up to its first tag, spawned by benchmarks.run --cold-starts
+
+Prints one JSON line of phase timings in seconds as soon as the first tag is produced, so the parent can also time
+the whole thing including interpreter startup.
+
+Usage: python -m benchmarks.cold_start --file test-files/1.m4a [--stub] [--no-prettify]
+"""
+
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', required=True)
+    parser.add_argument('--stub', action='store_true', help='use stub acoustic and punctuation models')
+    parser.add_argument('--no-prettify', action='store_true', help='skip punctuation, which then is never loaded')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--lm-model', default=None, help='KenLM model, no LM with --stub unless given')
+    args = parser.parse_args()
+    prettify = not args.no_prettify
+
+    phases = {}
+    start = time.perf_counter()
+    from src.asr_producer import ASRProducer, RuntimeConfig, load_prettifier, load_stt
+    from src.pretty import Prettifier
+    from src.stt import EnglishSTT
+    phases["import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if args.stub:
+        from benchmarks.stubs import StubASRModel
+        stt = EnglishSTT(None, args.lm_model, device=args.device, model=StubASRModel())
+    else:
+        stt = load_stt()
+    phases["load_stt"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prettifier = None
+    if prettify and args.stub:
+        from benchmarks.stubs import StubPunctuationModel
+        prettifier = Prettifier(5000, punctuation_model=StubPunctuationModel())
+    elif prettify:
+        prettifier = load_prettifier()
+    phases["load_prettifier"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cfg = RuntimeConfig(prettify=prettify, pretty_trail=False)
+    producer = ASRProducer(cfg, model=stt, prettifier=prettifier)
+    messages = producer.produce([args.file])
+    for msg in messages:
+        if msg.type == "tag":
+            break
+    phases["first_tag"] = time.perf_counter() - start
+    phases["total"] = time.perf_counter() - _START
+    print(json.dumps(phases), flush=True)
+
+    messages.close()
+    producer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Timing and resource accounting shared by the benchmark scripts"""
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]"""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@dataclass
+class StageStats:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    audio_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        total = sum(self.latencies)
+        return {
+            "stage": self.name,
+            "calls": len(self.latencies),
+            "total_s": total,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "audio_s": self.audio_seconds,
+            # audio seconds processed per wall second, and its inverse
+            "throughput": self.audio_seconds / total if total > 0 else 0.0,
+            "rtf": total / self.audio_seconds if self.audio_seconds > 0 else 0.0,
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+
+class Benchmark:
+    """Collects per-stage latencies, in the order stages are first timed"""
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.metrics: Dict[str, Any] = {}
+
+    @contextmanager
+    def time(self, stage: str, audio_seconds: float = 0.0) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, audio_seconds)
+
+    def record(self, stage: str, elapsed: float, audio_seconds: float = 0.0) -> None:
+        stats = self.stages.setdefault(stage, StageStats(name=stage))
+        stats.latencies.append(elapsed)
+        stats.audio_seconds += audio_seconds
+        stats.peak_rss_mb = peak_rss_mb()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [stats.summary() for stats in self.stages.values()]
+
+    def report(self) -> None:
+        print(f"{'stage':<28}{'calls':>7}{'p50 ms':>11}{'p95 ms':>11}{'audio-s/s':>12}{'RTF':>9}{'RSS MB':>9}")
+        for row in self.summary():
+            print(
+                f"{row['stage']:<28}{row['calls']:>7}{row['p50_ms']:>11.1f}{row['p95_ms']:>11.1f}"
+                f"{row['throughput']:>12.1f}{row['rtf']:>9.4f}{row['peak_rss_mb']:>9.0f}"
+            )
+        for name, value in self.metrics.items():
+            print(f"{name}: {value}")
+
+    def to_json(self, path: str, meta: Optional[Dict[str, Any]] = None) -> None:
+        with open(path, 'w') as f:
+            json.dump({"meta": meta or {}, "stages": self.summary(), "metrics": self.metrics}, f, indent=2)
+
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    """Print the per-stage p50 latency and throughput of two JSON reports side by side"""
+    with open(baseline_path) as f:
+        baseline = {row["stage"]: row for row in json.load(f)["stages"]}
+    with open(candidate_path) as f:
+        candidate = {row["stage"]: row for row in json.load(f)["stages"]}
+
+    print(f"{'stage':<28}{'base p50':>11}{'new p50':>11}{'speedup':>9}")
+    for stage, new in candidate.items():
+        old = baseline.get(stage)
+        if old is None:
+            print(f"{stage:<28}{'-':>11}{new['p50_ms']:>11.1f}{'-':>9}")
+            continue
+        speedup = old['p50_ms'] / new['p50_ms'] if new['p50_ms'] > 0 else float('inf')
+        print(f"{stage:<28}{old['p50_ms']:>11.1f}{new['p50_ms']:>11.1f}{speedup:>8.2f}x")
@@ -0,0 +1,64 @@
+"""
+Time MessageWriter on a synthetic transcript, tests/test_default_loop.py checks what it writes
+
+Usage: python -m benchmarks.jsonl_writer [--words 100000] [--words-per-file 1500] [--fsync]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from benchmarks.stubs import VOCABULARY
+from src.default_loop import MessageWriter
+from src.message_producer import Message, Progress, ProgressMessage, Tag, TagMessage
+
+
+def synthetic_messages(num_words: int, words_per_file: int, seed: int = 0) -> List[Message]:
+    """Word-level tags with a sentence-level tag and a progress message closing each file"""
+    rng = random.Random(seed)
+    messages: List[Message] = []
+    for start in range(0, num_words, words_per_file):
+        fname = f"/tmp/part-{start // words_per_file:05d}.m4a"
+        words = [rng.choice(VOCABULARY) for _ in range(min(words_per_file, num_words - start))]
+        for i, word in enumerate(words):
+            messages.append(TagMessage(type="tag", data=Tag(i * 400, i * 400 + 320, word, fname)))
+        text = " ".join(words).capitalize() + "."
+        messages.append(TagMessage(
+            type="tag", data=Tag(0, len(words) * 400, text, fname, track="auto_captions"),
+        ))
+        messages.append(ProgressMessage(type="progress", data=Progress(source_media=fname)))
+    return messages
+
+
+def _write(messages: List[Message], path: str, fsync: bool) -> None:
+    with open(path, 'w') as fout:
+        writer = MessageWriter(fout, fsync=fsync)
+        for msg in messages:
+            writer.write(msg)
+        writer.end_batch()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=100_000)
+    parser.add_argument('--words-per-file', type=int, default=1500)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--fsync', action='store_true', help="fsync once at the end of the batch")
+    args = parser.parse_args()
+
+    messages = synthetic_messages(args.words, args.words_per_file)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tags.jsonl")
+        best = float('inf')
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            _write(messages, path, args.fsync)
+            best = min(best, time.perf_counter() - start)
+        print(f"{len(messages)} messages in {best * 1000:.1f}ms (best of {args.repeats}), "
+              f"{len(messages) / best:,.0f} messages/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Time utils.postprocess on long random transcripts, tests/test_utils.py checks what it returns
+
+Usage: python -m benchmarks.postprocess [--words N] [--repeats N]
+"""
+
+import argparse
+import random
+import time
+from typing import List, Tuple
+
+from src.utils import postprocess
+
+VOCAB = [
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve", "twenty",
+    "thirty", "forty", "fifty", "sixty", "ninety", "hundred", "thousand", "million", "billion", "point", "zero",
+    "and", "th", "nd", "the", "year", "in", "was", "born", "of", "a", "d", "twenty-one", "1964", "42",
+]
+NUMERIC_RUNS = [
+    "one thousand nine hundred and sixty four",
+    "two thousand and twelve",
+    "nineteen hundred and fifty",
+    "five th",
+    "twenty nd",
+    "one million two hundred thousand and three",
+    "one point five",
+]
+
+
+def random_transcript(rng: random.Random, num_words: int) -> Tuple[str, List[Tuple[int, int]]]:
+    words: List[str] = []
+    while len(words) < num_words:
+        if rng.random() < 0.2:
+            words.extend(rng.choice(NUMERIC_RUNS).split())
+        else:
+            words.append(rng.choice(VOCAB))
+    timesteps = [(40 * i, 40 * i + 40) for i in range(len(words))]
+    return ' '.join(words), timesteps
+
+
+def bench(num_words: int, repeats: int, seed: int) -> None:
+    transcript, timesteps = random_transcript(random.Random(seed), num_words)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        postprocess(transcript, timesteps)
+    elapsed = (time.perf_counter() - start) / repeats
+    print(f"{elapsed * 1000:.1f}ms per {num_words} word transcript")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bench(args.words, args.repeats, args.seed)
+
+
+if __name__ == '__main__':
+    main()
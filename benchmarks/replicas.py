@@ -0,0 +1,77 @@
+"""
+Throughput of ASRProducer with the acoustic model in N replica processes against running it in process, and a check
+that the messages are the same
+
+Usage: python -m benchmarks.replicas --stub --devices cpu:0 cpu:1 [--repeat 4]
+"""
+
+import argparse
+import glob
+import sys
+import time
+from typing import List
+
+from loguru import logger
+
+from benchmarks.run import build_models
+from src.asr_producer import ASRProducer, RuntimeConfig, load_replica_stt, replica_probs
+from src.message_producer import Message
+from src.replicas import ReplicaPool
+
+
+def run(producer: ASRProducer, files: List[str]) -> List[Message]:
+    return list(producer.produce(files))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stub', action='store_true', help='use stub acoustic and punctuation models')
+    parser.add_argument('--devices', nargs='+', default=['cpu', 'cpu'], help='one replica per device, e.g. cpu:0-3')
+    parser.add_argument('--files', nargs='*', default=None, help='audio files, defaults to test-files/*.m4a')
+    parser.add_argument('--repeat', type=int, default=4, help='times the file list is repeated in the job')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--lm-model', default=None, help='KenLM model, no LM with --stub unless given')
+    parser.add_argument('--sentence-gap', type=int, default=5000)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    files = sorted(glob.glob('test-files/*.m4a')) if args.files is None else args.files
+    files = files * args.repeat
+    stt, prettifier = build_models(args)
+    if args.stub:
+        from benchmarks.stubs import load_stub_stt
+        load = load_stub_stt
+    else:
+        load = load_replica_stt
+    cfg = RuntimeConfig()
+
+    results = {}
+    for name in ("in process", f"{len(args.devices)} replicas"):
+        replicas = None
+        if name != "in process":
+            start = time.perf_counter()
+            replicas = ReplicaPool(args.devices, load, replica_probs)
+            print(f"started {len(replicas)} replicas in {time.perf_counter() - start:.1f}s")
+        producer = ASRProducer(cfg, model=stt, prettifier=prettifier, replicas=replicas)
+        try:
+            # warm up so the first measurement is not penalized
+            run(producer, files[:1])
+            start = time.perf_counter()
+            results[name] = run(producer, files)
+            elapsed = time.perf_counter() - start
+        finally:
+            producer.close()
+            if replicas is not None:
+                replicas.close()
+        print(f"{name:>12}: {elapsed:.2f}s for {len(files)} files")
+
+    first, second = results.values()
+    if first != second:
+        raise AssertionError("replicas produced different messages than running the model in process")
+    print(f"messages are identical ({len(first)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Times each stage of the ASR pipeline separately on the test files and on synthetic long audio
+
+Usage:
+    python -m benchmarks.run --stub                      # stub models, no GPU or weights needed
+    python -m benchmarks.run --stub --cold-starts 3      # also time fresh processes up to their first tag
+    python -m benchmarks.run --stub --variants exported bf16 exported+bf16   # acoustic model speed and WER
+    python -m benchmarks.run --json base.json            # models from config.yml
+    python -m benchmarks.run --compare base.json new.json
+"""
+
+import argparse
+import glob
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import torch
+from loguru import logger
+
+from benchmarks.harness import Benchmark, compare
+from src.audio import audio_file_to_tensor, SAMPLE_RATE
+from src.pretty import Prettifier
+from src.stt import EnglishSTT, FRAME_SIZE
+from src.tags import ModelTag
+from src.utils import postprocess, merge_to_sentences
+
+
+def synthetic_audio(seconds: float, seed: int = 0) -> torch.Tensor:
+    """Noise and tones with a syllable-rate envelope, shape (1, num_samples)"""
+    generator = torch.Generator().manual_seed(seed)
+    t = torch.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tones = sum(torch.sin(2 * math.pi * freq * t) for freq in (180.0, 440.0, 1250.0))
+    envelope = 0.5 + 0.5 * torch.sin(2 * math.pi * 4.0 * t)
+    noise = 0.05 * torch.randn(t.shape, generator=generator)
+    return (0.1 * tones * envelope + noise).unsqueeze(0)
+
+
+def build_models(args: argparse.Namespace) -> Tuple[EnglishSTT, Prettifier]:
+    if args.stub:
+        from benchmarks.stubs import StubASRModel, StubPunctuationModel
+        stt = EnglishSTT(None, args.lm_model, device=args.device, model=StubASRModel())
+        prettifier = Prettifier(args.sentence_gap, punctuation_model=StubPunctuationModel())
+        return stt, prettifier
+
+    from config import config
+    stt = EnglishSTT(
+        config["asr_model"],
+        args.lm_model or config["lm_model"],
+        chunk_length=config["inference"]["chunk_length"],
+        chunk_overlap=config["inference"]["chunk_overlap"],
+        batch_size=config["inference"]["batch_size"],
+        device=args.device,
+        cpu_threads=config["inference"]["cpu_threads"],
+        quantize=config["inference"]["quantize"],
+        cache_extracted=config["inference"]["cache_extracted_model"],
+        precision=config["inference"]["precision"],
+    )
+    prettifier = Prettifier(
+        config["postprocessing"]["sentence_gap"],
+        batch_size=config["postprocessing"]["punctuation_batch_size"],
+    )
+    return stt, prettifier
+
+
+def run_stages(bench: Benchmark, stt: EnglishSTT, prettifier: Prettifier, audio: torch.Tensor, duration: float):
+    with bench.time("_compute_probs", duration):
+        probs = stt._compute_probs(audio)
+    with bench.time("_beamsearch", duration):
+        prediction, _, timesteps, token_ids = stt._beamsearch(probs)
+    with bench.time("_get_word_level_timestamps", duration):
+        word_level_timestamps = stt._get_word_level_timestamps(timesteps, token_ids, FRAME_SIZE*1000)
+    with bench.time("postprocess", duration):
+        prediction, word_level_timestamps = postprocess(prediction, word_level_timestamps)
+    tags = [
+        ModelTag(start_time=round(start), end_time=round(end), tag=word)
+        for word, (start, end) in zip(prediction.split(), word_level_timestamps)
+        if word.lower() != "d"
+    ]
+    with bench.time("Prettifier.prettify", duration):
+        pretty = prettifier.prettify(tags)
+    with bench.time("merge_to_sentences", duration):
+        merge_to_sentences(pretty)
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """Word level edit distance"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+
+def build_variant(stt: EnglishSTT, variant: str, exported_path: str) -> EnglishSTT:
+    """stt's acoustic model exported and/or under autocast, e.g. "exported+bf16", without a language model"""
+    parts = variant.split('+')
+    unknown = set(parts) - {'exported', 'fp32', 'fp16', 'bf16'}
+    if unknown:
+        raise ValueError(f"Unknown variant: {variant}")
+    exported = 'exported' in parts
+    return EnglishSTT(
+        exported_path if exported else None,
+        None,
+        chunk_length=stt.chunk_samples / SAMPLE_RATE,
+        chunk_overlap=stt.overlap_samples / SAMPLE_RATE,
+        batch_size=stt.batch_size,
+        device=stt.device,
+        precision=next((p for p in parts if p in ('fp16', 'bf16')), 'fp32'),
+        model=None if exported else stt.model,
+    )
+
+
+def compare_variants(
+    bench: Benchmark,
+    args: argparse.Namespace,
+    stt: EnglishSTT,
+    inputs: List[Tuple[str, torch.Tensor, float]],
+    files: List[str],
+) -> None:
+    """
+    Times _compute_probs of each acoustic model variant against stt's own, and records the WER of its transcripts
+    of the test files against stt's. Transcripts are all decoded by stt, so only the acoustic model differs.
+    """
+    if stt.outputs_probs:
+        raise ValueError("Variants are built from the .nemo model, asr_model is already an exported one")
+    with tempfile.TemporaryDirectory() as tmp:
+        exported_path = f"{tmp}/asr.ts"
+        if any('exported' in variant for variant in args.variants):
+            stt.export(exported_path)
+        variants = [("fp32", stt)] + [(v, build_variant(stt, v, exported_path)) for v in args.variants]
+
+        references = {}
+        for name, model in variants:
+            errors, words = 0, 0
+            # warm up, the first call of a traced graph also optimizes it
+            model._compute_probs(inputs[0][1])
+            for _ in range(args.repeats):
+                for fname, audio, duration in inputs:
+                    start = time.perf_counter()
+                    model._compute_probs(audio)
+                    bench.record(f"_compute_probs[{name}]", time.perf_counter() - start, duration)
+            for fname, audio, _ in inputs:
+                if fname not in files:
+                    continue
+                transcript = [tag.tag for tag in stt.tag_probs(model._compute_probs(audio))]
+                reference = references.setdefault(fname, transcript)
+                errors += word_errors(reference, transcript)
+                words += len(reference)
+            if name != "fp32":
+                bench.metrics[f"wer[{name}]"] = round(errors / max(words, 1), 4)
+
+
+def time_cold_starts(bench: Benchmark, args: argparse.Namespace, fname: str) -> None:
+    """Spawns fresh processes running benchmarks.cold_start and records their startup phases"""
+    cmd = [sys.executable, '-m', 'benchmarks.cold_start', '--file', fname, '--device', args.device]
+    if args.stub:
+        cmd.append('--stub')
+    if args.lm_model:
+        cmd += ['--lm-model', args.lm_model]
+    if args.no_prettify:
+        cmd.append('--no-prettify')
+
+    for _ in range(args.cold_starts):
+        start = time.perf_counter()
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            # the child prints its phases the moment it has a tag, before shutting down
+            line = process.stdout.readline()
+            elapsed = time.perf_counter() - start
+            process.wait()
+        if process.returncode != 0 or not line:
+            raise RuntimeError(f"cold start failed with exit code {process.returncode}: {' '.join(cmd)}")
+        for phase, seconds in json.loads(line).items():
+            if phase != "total":
+                bench.record(f"startup.{phase}", seconds)
+        bench.record("time_to_first_tag", elapsed)
+
+    bench.metrics["time_to_first_tag_p50_s"] = round(bench.stages["time_to_first_tag"].summary()["p50_ms"] / 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stub', action='store_true', help='use stub acoustic and punctuation models')
+    parser.add_argument('--files', nargs='*', default=None, help='audio files, defaults to test-files/*.m4a')
+    parser.add_argument('--synthetic-seconds', type=float, nargs='*', default=[60.0, 600.0],
+                        help='lengths of synthetic audio to run through the model stages')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--lm-model', default=None, help='KenLM model, no LM with --stub unless given')
+    parser.add_argument('--sentence-gap', type=int, default=5000)
+    parser.add_argument('--cold-starts', type=int, default=0,
+                        help='number of fresh processes to time from launch to their first tag')
+    parser.add_argument('--no-prettify', action='store_true', help='cold starts without punctuation')
+    parser.add_argument('--variants', nargs='*', default=[],
+                        help='acoustic model variants to time and score by WER against the fp32 .nemo model on the '
+                             'files: exported, fp16, bf16, or combined like exported+bf16')
+    parser.add_argument('--json', default=None, help='write the report to this path')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'), default=None)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # per-call debug logging would dominate the cheaper stages
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    files = sorted(glob.glob('test-files/*.m4a')) if args.files is None else args.files
+    bench = Benchmark()
+    # before this process loads anything, so the children don't compete with it for memory
+    if args.cold_starts > 0 and files:
+        time_cold_starts(bench, args, files[0])
+    stt, prettifier = build_models(args)
+
+    inputs: List[Tuple[str, torch.Tensor, float]] = []
+    for fname in files:
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            audio, duration = audio_file_to_tensor(fname)
+            bench.record("audio_file_to_tensor", time.perf_counter() - start, duration)
+        inputs.append((fname, audio, duration))
+    for seconds in args.synthetic_seconds:
+        inputs.append((f"synthetic-{seconds:g}s", synthetic_audio(seconds), seconds))
+
+    # warm up allocators and lazy initialization outside of the measurements
+    if inputs:
+        run_stages(Benchmark(), stt, prettifier, inputs[0][1], inputs[0][2])
+
+    for _ in range(args.repeats):
+        for _, audio, duration in inputs:
+            run_stages(bench, stt, prettifier, audio, duration)
+    if args.variants:
+        compare_variants(bench, args, stt, inputs, files)
+
+    bench.report()
+    if args.json:
+        bench.to_json(args.json, meta={
+            "stub": args.stub,
+            "device": stt.device,
+            "inputs": [name for name, _, _ in inputs],
+            "repeats": args.repeats,
+            "cold_starts": args.cold_starts,
+            "variants": args.variants,
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+        })
+
+
+if __name__ == '__main__':
+    main()
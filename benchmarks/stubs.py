@@ -0,0 +1,142 @@
+"""
+Stand-ins for the NeMo acoustic model and the punctuation model with random weights
+
+They have the same interfaces and output shapes as the real models, so every stage around them runs unchanged
+without a GPU or downloaded weights. The transcripts they produce are meaningless.
+"""
+
+import re
+import zlib
+from types import SimpleNamespace
+from typing import List
+
+import torch
+
+from src.stt import EnglishSTT, FRAME_SAMPLES
+
+# the blank token is appended after these by EnglishSTT (id 128)
+VOCABULARY = (
+    ["▁the", "▁a", "▁and", "▁of", "▁to", "▁in", "▁is", "▁was", "▁it", "▁that", "▁he", "▁she", "▁they", "▁we",
+     "▁one", "▁two", "▁three", "▁four", "▁five", "▁nine", "▁sixty", "▁hundred", "▁thousand", "▁d", "▁th"]
+    + [f"▁w{i}" for i in range(55)]
+    + ["s", "ed", "ing", "er", "ly", "th", "nd"]
+    + [f"x{i}" for i in range(41)]
+)
+PUNCTUATION_LABELS = {0: "0", 1: ".", 2: ",", 3: "?", 4: "-", 5: ":"}
+
+
+class StubTokenizer:
+    def __init__(self, vocabulary: List[str]):
+        self.vocabulary = vocabulary
+
+    def ids_to_tokens(self, ids: List[int]) -> List[str]:
+        return [self.vocabulary[i] for i in ids]
+
+    def ids_to_text(self, ids: List[int]) -> str:
+        return ''.join(self.ids_to_tokens(ids)).replace('▁', ' ').strip()
+
+
+class StubASRModel(torch.nn.Module):
+    """Same forward signature and 40ms output frames as EncDecCTCModelBPE"""
+
+    def __init__(self, seed: int = 0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.encoder = torch.nn.Conv1d(1, 64, kernel_size=FRAME_SAMPLES, stride=FRAME_SAMPLES)
+        self.proj = torch.nn.Linear(64, len(VOCABULARY) + 1)
+        with torch.no_grad():
+            for param in self.parameters():
+                param.copy_(torch.randn(param.shape, generator=generator) * 0.5)
+            # make blank the most likely output so transcripts are about as sparse as real ones
+            self.proj.bias[len(VOCABULARY)] += 3.0
+        self.tokenizer = StubTokenizer(VOCABULARY)
+        self.decoder = SimpleNamespace(vocabulary=VOCABULARY)
+
+    def forward(self, input_signal: torch.Tensor, input_signal_length: torch.Tensor):
+        features = torch.tanh(self.encoder(input_signal.unsqueeze(1)))
+        logits = self.proj(features.transpose(1, 2))
+        encoded_len = torch.div(input_signal_length, FRAME_SAMPLES, rounding_mode='floor')
+        return torch.log_softmax(logits, dim=-1), encoded_len, logits.argmax(dim=-1)
+
+
+class _Encoding(dict):
+    def to(self, device: torch.device) -> '_Encoding':
+        return _Encoding({k: v.to(device) for k, v in self.items()})
+
+
+class StubWordTokenizer:
+    """Whitespace tokenizer with the subset of the transformers tokenizer interface Prettifier uses"""
+
+    def __call__(self, texts: List[str], **kwargs) -> _Encoding:
+        rows = [[(m.start(), m.end()) for m in re.finditer(r'\S+', text)] for text in texts]
+        width = max((len(row) for row in rows), default=0)
+        input_ids = torch.zeros(len(texts), width, dtype=torch.long)
+        attention = torch.zeros(len(texts), width, dtype=torch.long)
+        special = torch.ones(len(texts), width, dtype=torch.long)
+        offsets = torch.zeros(len(texts), width, 2, dtype=torch.long)
+        for i, (text, row) in enumerate(zip(texts, rows)):
+            for k, (start, end) in enumerate(row):
+                input_ids[i, k] = zlib.crc32(text[start:end].encode()) % 1000
+                attention[i, k] = 1
+                special[i, k] = 0
+                offsets[i, k, 0] = start
+                offsets[i, k, 1] = end
+        return _Encoding(
+            input_ids=input_ids,
+            attention_mask=attention,
+            special_tokens_mask=special,
+            offset_mapping=offsets,
+        )
+
+
+class StubTokenClassifier(torch.nn.Module):
+    def __init__(self, seed: int = 0):
+        super().__init__()
+        torch.manual_seed(seed)
+        self.embedding = torch.nn.Embedding(1000, 64)
+        self.layer = torch.nn.TransformerEncoderLayer(d_model=64, nhead=4, dim_feedforward=128)
+        self.head = torch.nn.Linear(64, len(PUNCTUATION_LABELS))
+        with torch.no_grad():
+            # mostly no punctuation, like real text
+            self.head.bias[0] += 2.0
+        self.config = SimpleNamespace(id2label=PUNCTUATION_LABELS)
+        self.eval()
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        hidden = self.embedding(input_ids).transpose(0, 1)
+        hidden = self.layer(hidden, src_key_padding_mask=attention_mask == 0).transpose(0, 1)
+        return (self.head(hidden),)
+
+
+class StubPunctuationModel:
+    """The parts of deepmultilingualpunctuation.PunctuationModel that Prettifier uses"""
+
+    def __init__(self, seed: int = 0):
+        self.pipe = SimpleNamespace(
+            tokenizer=StubWordTokenizer(),
+            model=StubTokenClassifier(seed),
+            device=torch.device('cpu'),
+        )
+
+    def preprocess(self, text: str) -> List[str]:
+        text = re.sub(r"(?<!\d)[.,;:!?](?!\d)", "", text)
+        return text.split()
+
+    def overlap_chunks(self, lst: list, n: int, stride: int = 0):
+        for i in range(0, len(lst), n - stride):
+            yield lst[i:i + n]
+
+    def prediction_to_text(self, prediction: List[list]) -> str:
+        result = ""
+        for word, label, _ in prediction:
+            result += word
+            if label == "0":
+                result += " "
+            if label in ".,?-:":
+                result += label + " "
+        return result.strip()
+
+
+def load_stub_stt(device: str) -> EnglishSTT:
+    """Replica loader for ReplicaPool with the stub acoustic model and no language model"""
+    return EnglishSTT(None, None, device=device, model=StubASRModel())
@@ -0,0 +1,76 @@
+"""
+Memory held by the trail and boundary window reads, the contiguous TrailBuffer against keeping each file's probs
+
+Per-file probs come out of the acoustic model as views into padded batches, which is what the trail used to keep.
+
+Usage: python -m benchmarks.trail_buffer [--window 30] [--batch-size 8] [--windows 20]
+"""
+
+import argparse
+import math
+import time
+from typing import List
+
+import torch
+
+from src.asr_producer import TrailBuffer
+from src.stt import FRAME_SIZE
+
+VOCAB_SIZE = 129
+
+
+def model_output(durations: List[float], generator: torch.Generator) -> List[torch.Tensor]:
+    """Per-file views into one padded batch, like EnglishSTT._forward returns them"""
+    frames = [round(d / FRAME_SIZE) for d in durations]
+    batch = torch.rand(len(frames), max(frames), VOCAB_SIZE, generator=generator)
+    return [batch[i:i + 1, :n] for i, n in enumerate(frames)]
+
+
+def held_bytes(tensors: List[torch.Tensor]) -> int:
+    storages = {t.storage().data_ptr(): t.storage().size() * t.element_size() for t in tensors}
+    return sum(storages.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--window', type=float, default=30.0, help='pretty_trail_buffer in seconds')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--windows', type=int, default=20)
+    parser.add_argument('--boundary', type=float, default=2.0, help='pretty_trail_boundary in seconds')
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    num_frames = math.ceil(2 * args.boundary / FRAME_SIZE)
+    buffer = TrailBuffer(math.ceil(2 * args.window / FRAME_SIZE))
+    stats = {"list": [0, 0.0], "buffer": [0, 0.0]}
+
+    for _ in range(args.windows):
+        pieces: List[torch.Tensor] = []
+        while sum(p.size(1) for p in pieces) * FRAME_SIZE < args.window:
+            # live segments are a few seconds each, with the occasional long one padding the batch
+            durations = (2 + 8 * torch.rand(args.batch_size, generator=generator) ** 4).tolist()
+            for probs in model_output(durations, generator):
+                pieces.append(probs)
+                buffer.add("", probs, [], probs.size(1) * FRAME_SIZE)
+
+        start = time.perf_counter()
+        for prev, nxt in zip(pieces, pieces[1:]):
+            torch.cat([prev[:, -num_frames:], nxt[:, :num_frames]], dim=1).sum()
+        stats["list"][1] += time.perf_counter() - start
+        stats["list"][0] = max(stats["list"][0], held_bytes(pieces))
+
+        start = time.perf_counter()
+        for prev, nxt in zip(buffer.segments, buffer.segments[1:]):
+            tail, head = min(num_frames, prev.probs.size(1)), min(num_frames, nxt.probs.size(1))
+            buffer.frames(nxt.first_frame - tail, nxt.first_frame + head).sum()
+        stats["buffer"][1] += time.perf_counter() - start
+        stats["buffer"][0] = max(stats["buffer"][0], held_bytes([buffer.storage]))
+        buffer.clear()
+
+    for name, (peak, elapsed) in stats.items():
+        print(f"{name:>8}: {peak / 2 ** 20:7.1f}MB held at most, "
+              f"{elapsed / args.windows * 1000:6.2f}ms of boundary windows per {args.window:g}s window")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Throughput and word timing agreement of the energy VAD pre-pass against transcribing every sample
+
+Each test file is run as is, and padded with silence on both sides the way broadcast segments often are.
+
+Usage: python -m benchmarks.vad [--stub] [--files ...] [--silence 20]
+"""
+
+import argparse
+import glob
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import torch
+from loguru import logger
+
+from benchmarks.run import build_models
+from config import config
+from src.audio import audio_file_to_tensor, SAMPLE_RATE
+from src.stt import EnglishSTT
+from src.tags import ModelTag
+from src.vad import speech_regions
+
+# words whose start moved by more than this are counted as disagreeing (in ms)
+MATCH_TOLERANCE = 80
+
+
+def agreement(baseline: List[ModelTag], candidate: List[ModelTag]) -> Dict[str, float]:
+    """Share of baseline words found again in order with the same text and a close start, and their mean shift"""
+    matched, shifts, j = 0, [], 0
+    for tag in baseline:
+        while j < len(candidate) and candidate[j].start_time < tag.start_time - MATCH_TOLERANCE:
+            j += 1
+        if j < len(candidate) and candidate[j].tag == tag.tag \
+                and abs(candidate[j].start_time - tag.start_time) <= MATCH_TOLERANCE:
+            matched += 1
+            shifts.append(abs(candidate[j].start_time - tag.start_time))
+            j += 1
+    return {
+        "recall": matched / len(baseline) if baseline else 1.0,
+        "precision": matched / len(candidate) if candidate else 1.0,
+        "mean_shift_ms": sum(shifts) / len(shifts) if shifts else 0.0,
+    }
+
+
+def transcribe(stt: EnglishSTT, audio: torch.Tensor, vad: bool) -> Tuple[List[ModelTag], float, float]:
+    """Returns (tags, seconds, share of the audio sent through the model)"""
+    start = time.perf_counter()
+    if vad:
+        params = {k: v for k, v in config["vad"].items() if k != "enabled"}
+        regions = speech_regions(audio, **params)
+        probs = stt.compute_probs_regions_batch([audio], [regions])[0]
+        voiced = sum(end - begin for begin, end in regions) / max(audio.size(1), 1)
+    else:
+        probs = stt.compute_probs_batch([audio])[0]
+        voiced = 1.0
+    tags = stt.tag_probs(probs)
+    return tags, time.perf_counter() - start, voiced
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stub', action='store_true', help='use stub acoustic and punctuation models')
+    parser.add_argument('--files', nargs='*', default=None, help='audio files, defaults to test-files/*.m4a')
+    parser.add_argument('--silence', type=float, default=20.0, help='seconds of silence added on each side')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--lm-model', default=None, help='KenLM model, no LM with --stub unless given')
+    parser.add_argument('--sentence-gap', type=int, default=5000)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+
+    files = sorted(glob.glob('test-files/*.m4a')) if args.files is None else args.files
+    stt, _ = build_models(args)
+    generator = torch.Generator().manual_seed(0)
+
+    print(f"{'input':<32}{'voiced':>8}{'full s':>9}{'vad s':>9}{'speedup':>9}{'recall':>8}{'precision':>11}{'shift ms':>10}")
+    for fname in files:
+        audio, _ = audio_file_to_tensor(fname)
+        # faint noise rather than digital zeros, like the quiet parts of a broadcast
+        pad = 1e-4 * torch.randn(1, int(args.silence * SAMPLE_RATE), generator=generator)
+        padded = torch.cat([pad, audio, pad], dim=1)
+        offset = round(args.silence * 1000)
+
+        for name, item in [(fname, audio), (f"{fname} +silence", padded)]:
+            # warm up so the first measurement is not penalized
+            transcribe(stt, item, vad=False)
+            full_tags, full_time, _ = transcribe(stt, item, vad=False)
+            vad_tags, vad_time, voiced = transcribe(stt, item, vad=True)
+            if item is padded:
+                # words hallucinated in the padding would count against precision, which is what we want
+                full_tags = [t for t in full_tags if offset <= t.start_time < offset + round(audio.size(1) / 16)]
+            stats = agreement(full_tags, vad_tags)
+            print(
+                f"{name[-32:]:<32}{voiced:>8.2f}{full_time:>9.3f}{vad_time:>9.3f}{full_time / vad_time:>8.2f}x"
+                f"{stats['recall']:>8.3f}{stats['precision']:>11.3f}{stats['mean_shift_ms']:>10.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
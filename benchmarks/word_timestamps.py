@@ -0,0 +1,63 @@
+"""
+Time the beam search output handling and word timestamps on long beams, tests/test_stt.py checks what they return
+
+The decoder is replaced by synthetic hour-long beams, so this only measures what happens after beam search.
+
+Usage: python -m benchmarks.word_timestamps [--hours 1] [--repeats 5]
+"""
+
+import argparse
+import time
+from typing import List, Tuple
+
+import torch
+
+from benchmarks.stubs import StubASRModel
+from src.stt import EnglishSTT, FRAME_SIZE
+
+
+def synthetic_beam(seconds: float, seed: int = 0) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Decoder output shaped like CTCBeamDecoder.decode for one item, about one token per 3 frames"""
+    generator = torch.Generator().manual_seed(seed)
+    num_frames = int(seconds / FRAME_SIZE)
+    num_tokens = num_frames // 3
+    frames = torch.sort(torch.randint(0, num_frames, (num_tokens,), generator=generator)).values
+    # the decoder occasionally reports a timestep earlier than the previous one
+    jitter = torch.randint(-2, 1, (num_tokens,), generator=generator)
+    jitter *= torch.rand(num_tokens, generator=generator) < 0.05
+    frames = (frames + jitter).clamp(min=0).int()
+    token_ids = torch.randint(0, 128, (num_tokens,), generator=generator).int()
+    return (
+        token_ids.view(1, 1, -1),
+        torch.zeros(1, 1),
+        frames.view(1, 1, -1),
+        torch.IntTensor([[num_tokens]]),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    stt = EnglishSTT(None, None, device='cpu', model=StubASRModel())
+    decoded = synthetic_beam(args.hours * 3600)
+    stt.decoder.decode = lambda batch, seq_lens: decoded
+    # decode is stubbed out, so the probs only need the right rank
+    probs = torch.zeros(1, 1, len(stt.word_start))
+
+    def decode_words() -> Tuple[str, List[Tuple[float, float]]]:
+        pred_text, _, timesteps, token_ids = stt._beamsearch(probs)
+        return pred_text, stt._get_word_level_timestamps(timesteps, token_ids, FRAME_SIZE * 1000)
+
+    best = float('inf')
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        _, word_timestamps = decode_words()
+        best = min(best, time.perf_counter() - start)
+    print(f"{best * 1000:.1f}ms for {args.hours:g}h of audio ({len(word_timestamps)} words, best of {args.repeats})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+
+import argparse
+import json
+import sys
+import urllib.request
+from typing import Any, Dict, Iterator, List
+
+from config import config
+
+def submit(url: str, files: List[str], params: Dict[str, Any]) -> Iterator[str]:
+    """
+    Runs a job on a server and yields the JSONL lines of its response as they arrive
+
+    Args:
+        url: Base url of the server, e.g. http://127.0.0.1:8090
+        files: Paths to tag, as seen by the server
+        params: RuntimeConfig fields to override
+
+    Returns:
+        Lines including their trailing newline
+    """
+    request = urllib.request.Request(
+        url.rstrip("/") + "/transcribe",
+        data=json.dumps({"files": files, "params": params}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            yield line.decode("utf-8")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tag files with a running serve.py instead of loading the models")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--url', type=str, default=f'http://{config["server"]["host"]}:{config["server"]["port"]}')
+    parser.add_argument('--params', type=str, default=None, help='Runtime parameters as JSON')
+    parser.add_argument('--output-path', type=str, default=None, help='Append the tags here instead of printing them')
+    args = parser.parse_args()
+    params = json.loads(args.params) if args.params else {}
+
+    fout = open(args.output_path, 'a') if args.output_path else sys.stdout
+    try:
+        for line in submit(args.url, args.files, params):
+            fout.write(line)
+            fout.flush()
+    finally:
+        if fout is not sys.stdout:
+            fout.close()
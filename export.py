@@ -0,0 +1,21 @@
+import argparse
+
+from src.asr_producer import load_stt
+from config import config
+
+"""
+Traces the configured .nemo acoustic model into a TorchScript file, point asr_model in config.yml at it to use it.
+
+Exported on the device and with the quantization of config.yml, load it on the same kind of device.
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', type=str, default=config["asr_model"].rsplit(".", 1)[0] + ".ts")
+    parser.add_argument('--device', type=str, default=config["inference"]["device"])
+    args = parser.parse_args()
+
+    if config["asr_model"].endswith(".ts"):
+        raise SystemExit(f"asr_model is already an exported model: {config['asr_model']}")
+    stt = load_stt(device=args.device, with_lm=False)
+    stt.export(args.output)
@@ -6,6 +6,8 @@ import setproctitle
 from loguru import logger
 
 from src.asr_producer import ASRProducer, RuntimeConfig
+from src.metrics import StageMetrics
+from config import config
 from src.default_loop import catch_errors, start_loop_from_producer, get_params
 
 if __name__ == '__main__':
@@ -19,5 +21,21 @@ if __name__ == '__main__':
     params = get_params()
     params = from_dict(data=params, data_class=RuntimeConfig)
     
-    producer = ASRProducer(params)
-    start_loop_from_producer(producer, args.output_path, continue_on_error=True)
\ No newline at end of file
+    metrics = None
+    if config["metrics"]["enabled"]:
+        metrics = StageMetrics(args.output_path + ".metrics.jsonl", args.output_path + ".prom")
+
+    producer = ASRProducer(params, metrics=metrics)
+    try:
+        start_loop_from_producer(
+            producer,
+            args.output_path,
+            continue_on_error=True,
+            batch_limit=config["inference"]["batch_size"],
+            fsync=config["output"]["fsync"],
+        )
+    finally:
+        # stops the replica processes the producer started
+        producer.close()
+        if metrics is not None:
+            metrics.close()
\ No newline at end of file
@@ -0,0 +1,28 @@
+
+import argparse
+import setproctitle
+from loguru import logger
+
+from src.asr_producer import load_stt, load_prettifier, start_replicas
+from src.server import ASRServer
+from config import config
+
+if __name__ == '__main__':
+    setproctitle.setproctitle("model-asr-server")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default=config["server"]["host"])
+    parser.add_argument('--port', type=int, default=config["server"]["port"])
+    args = parser.parse_args()
+
+    replicas = start_replicas() if config["inference"]["replicas"] else None
+    server = ASRServer((args.host, args.port), load_stt(), load_prettifier(), replicas)
+    logger.info(f"Models loaded, serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if replicas is not None:
+            replicas.close()
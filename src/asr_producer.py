@@ -1,13 +1,23 @@
-from typing import List, Optional, Iterator
-from dataclasses import dataclass, asdict
+from typing import List, Optional, Iterator, Tuple, Deque, Dict
+from dataclasses import dataclass, asdict, field
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import math
+import os
+import threading
+import time
 import torch
 from loguru import logger
 
-from src.stt import EnglishSTT
+from src.stt import EnglishSTT, FRAME_SIZE
 from src.pretty import Prettifier
 from src.tags import ModelTag, AugmentedTag
 from src.audio import audio_file_to_tensor
-from src.utils import combine_tags
+from src.utils import combine_tags, merge_to_sentences
+from src.metrics import StageMetrics
+from src.cache import ResultCache, CachedResult, cache_namespace
+from src.vad import speech_regions
+from src.replicas import ReplicaPool
 from config import config
 from src.message_producer import (
     TagMessageProducer,
@@ -27,86 +37,606 @@ class RuntimeConfig:
     prettify: bool = True
     pretty_trail: bool = True
     pretty_trail_buffer: int = 30
-
-
-class AudioBuffer:
-    """Accumulates audio tensors and metadata for trailing buffer processing"""
-
-    def __init__(self):
-        self.tensors: List[torch.Tensor] = []
+    # seconds of context on each side of a file boundary that are re-decoded for the trail track
+    pretty_trail_boundary: float = 2.0
+    # only emit the sentences finished within a trail window, the unfinished one is completed in the next window,
+    # which may be that of the next produce() call, finish() emits it once no more files are coming
+    pretty_trail_incremental: bool = False
+    # seconds an unfinished sentence may be held back before it is emitted anyway, with pretty_trail_incremental
+    pretty_trail_max_latency: float = 45.0
+    # index of the audio stream to transcribe in multi-track files, the one ffmpeg considers best if None
+    audio_stream: Optional[int] = None
+    # "beam" for the KenLM beam search, "greedy" for much cheaper best path decoding without a language model
+    decoder: str = "beam"
+    beam_width: int = 32
+    # language model weight and per-word bonus of the beam search
+    alpha: float = 0.25
+    beta: float = 0.5
+
+
+@dataclass
+class Transcription:
+    """First-pass STT output of a single file"""
+    fname: str
+    duration: float = 0.0
+    # decoded audio, shape (1, num_samples), dropped once the acoustic model has run
+    audio: Optional[torch.Tensor] = None
+    # acoustic model output, shape (1, num_frames, vocab_size)
+    probs: Optional[torch.Tensor] = None
+    # raw word-level tags, relative to the start of the file
+    tags: List[ModelTag] = field(default_factory=list)
+    # tags after prettification / combining, as emitted on the default track
+    output_tags: List[ModelTag] = field(default_factory=list)
+    error: Optional[Exception] = None
+    # wall time in seconds spent on this file per stage
+    timings: Dict[str, float] = field(default_factory=dict)
+    # content hash of the file if the result cache is enabled
+    cache_key: Optional[str] = None
+    # whether the result came from the cache, in which case the model stages are skipped
+    cached: bool = False
+
+
+@dataclass
+class TrailSegment:
+    fname: str
+    # start of the file in ms, relative to the start of the trail window
+    offset: int
+    # first frame of the file in the trail buffer's storage
+    first_frame: int
+    # acoustic model output for the file, a view into the trail buffer of shape (1, num_frames, vocab_size)
+    probs: torch.Tensor
+    # raw word-level tags, relative to the start of the file
+    tags: List[ModelTag]
+    # in seconds
+    duration: float
+
+
+class TrailBuffer:
+    """
+    Accumulates first-pass STT output of consecutive files for trailing buffer processing
+
+    The probs of consecutive files are written back to back into one preallocated tensor, so any run of frames,
+    including one across a file boundary, is a view. The storage only grows, by doubling, and is reused across windows.
+
+    Args:
+        initial_frames: Frames to allocate for on the first add, usually about one window
+    """
+
+    def __init__(self, initial_frames: int = 0):
+        self.segments: List[TrailSegment] = []
         self.total_duration: float = 0.0
-
-    def add(self, tensor: torch.Tensor, duration: float):
-        self.tensors.append(tensor)
+        self.initial_frames = initial_frames
+        self.storage: Optional[torch.Tensor] = None
+        # [start, end) range of storage frames held by the segments
+        self.start = 0
+        self.end = 0
+        # in ms relative to the window start, words before this were emitted with the previous window
+        self.emitted_until = 0
+        # words the previous window decoded in the carried files and where those files ended, in ms relative to the
+        # window start, they are kept over the new decode so the carried sentence is not cut from a different decode
+        self.carried: List[ModelTag] = []
+        self.carried_until = 0
+
+    def add(self, fname: str, probs: torch.Tensor, tags: List[ModelTag], duration: float):
+        offset = round(self.total_duration * 1000)
+        num_frames = probs.size(1)
+        self._reserve(probs, num_frames)
+        first = self.end
+        self.end += num_frames
+        # copied rather than kept, probs is usually a view that would keep its whole padded inference batch alive
+        self.storage[:, first:self.end].copy_(probs)
+        self.segments.append(TrailSegment(
+            fname=fname,
+            offset=offset,
+            first_frame=first,
+            probs=self.storage[:, first:self.end],
+            tags=tags,
+            duration=duration,
+        ))
         self.total_duration += duration
 
-    def get_combined_tensor(self) -> torch.Tensor:
-        return torch.cat(self.tensors, dim=1)
+    def frames(self, start: int, end: int) -> torch.Tensor:
+        """View of storage frames [start, end), of shape (1, end - start, vocab_size)"""
+        return self.storage[:, start:end]
+
+    def files(self) -> List[str]:
+        return [seg.fname for seg in self.segments]
 
     def clear(self):
-        self.tensors = []
+        self.segments = []
         self.total_duration = 0.0
+        self.start = self.end = 0
+        self.emitted_until = 0
+        self.carried = []
+        self.carried_until = 0
+
+    def carry_over(self, from_time: int, tags: List[ModelTag]):
+        """
+        Start the next window with the file containing from_time, in ms relative to the current window. That file and
+        the ones after it stay in place with offsets rebased, earlier ones are dropped. Words before from_time are
+        remembered as emitted, and tags, the words of the current window, are kept for the files carried over.
+        """
+        index = 0
+        while index + 1 < len(self.segments) and self.segments[index + 1].offset <= from_time:
+            index += 1
+        kept = self.segments[index:]
+        base = kept[0].offset
+        self.emitted_until = from_time - base
+        self.carried = [
+            ModelTag(start_time=tag.start_time - base, end_time=tag.end_time - base, tag=tag.tag)
+            for tag in tags if tag.start_time >= base
+        ]
+        self.segments = []
+        self.total_duration = 0.0
+        for seg in kept:
+            seg.offset = round(self.total_duration * 1000)
+            self.segments.append(seg)
+            self.total_duration += seg.duration
+        self.carried_until = round(self.total_duration * 1000)
+        self.start = kept[0].first_frame
 
     def is_ready(self, threshold: float) -> bool:
-        return self.total_duration >= threshold
+        # carried files were processed with the previous window, only new audio counts toward the next one
+        return self.total_duration - self.carried_until / 1000 >= threshold
 
     def is_empty(self) -> bool:
-        return len(self.tensors) == 0
+        return len(self.segments) == 0
 
+    def _reserve(self, like: torch.Tensor, num_frames: int):
+        """Make room for num_frames more frames after end, moving the frames in use to the front if needed"""
+        if self.storage is None:
+            capacity = max(self.initial_frames, num_frames)
+            self.storage = torch.empty(1, capacity, like.size(2), dtype=like.dtype, device=like.device)
+            return
+        capacity = self.storage.size(1)
+        if self.end + num_frames <= capacity:
+            return
 
-class ASRProducer(TagMessageProducer):
+        used = self.end - self.start
+        if used + num_frames <= capacity and used <= self.start:
+            # the carried frames fit in front of themselves, no new allocation
+            storage = self.storage
+        else:
+            capacity = max(2 * capacity, used + num_frames)
+            storage = torch.empty(
+                1, capacity, self.storage.size(2), dtype=self.storage.dtype, device=self.storage.device)
+        storage[:, :used].copy_(self.storage[:, self.start:self.end])
+        self.storage = storage
+        for seg in self.segments:
+            seg.first_frame -= self.start
+            seg.probs = self.storage[:, seg.first_frame:seg.first_frame + seg.probs.size(1)]
+        self.start, self.end = 0, used
+
+
+def load_stt(device: Optional[str] = None, with_lm: bool = True) -> EnglishSTT:
+    """
+    Loads the acoustic model and beam search decoder from config
+
+    Args:
+        device: Overrides the configured device
+        with_lm: Whether the beam search decoder uses the language model, replicas only run the acoustic model
+    """
+    # with replicas the acoustic model runs in their processes, this copy is only used for decoding
+    decode_only = device is None and len(config["inference"]["replicas"]) > 0
+    if device is None:
+        device = "cpu" if decode_only else config["inference"]["device"]
+    return EnglishSTT(
+        config["asr_model"],
+        config["lm_model"] if with_lm else None,
+        chunk_length=config["inference"]["chunk_length"],
+        chunk_overlap=config["inference"]["chunk_overlap"],
+        batch_size=config["inference"]["batch_size"],
+        device=device,
+        cpu_threads=config["inference"]["cpu_threads"],
+        quantize=config["inference"]["quantize"],
+        cache_extracted=config["inference"]["cache_extracted_model"],
+        precision=config["inference"]["precision"],
+        decode_only=decode_only,
+    )
+
+
+def load_replica_stt(device: str) -> EnglishSTT:
+    """Model of a replica process, see start_replicas"""
+    return load_stt(device, with_lm=False)
+
+
+def start_replicas() -> ReplicaPool:
+    """Starts the acoustic model replicas from config"""
+    return ReplicaPool(
+        config["inference"]["replicas"],
+        load_replica_stt,
+        replica_probs,
+        threads=config["inference"]["cpu_threads"],
+    )
+
+
+def compute_probs(model: EnglishSTT, audios: List[torch.Tensor]) -> List[torch.Tensor]:
+    """Acoustic model output for each audio, only over the speech regions if vad is enabled"""
+    if not config["vad"]["enabled"]:
+        return model.compute_probs_batch(audios)
+    vad_params = {k: v for k, v in config["vad"].items() if k != "enabled"}
+    regions = [speech_regions(audio, **vad_params) for audio in audios]
+    return model.compute_probs_regions_batch(audios, regions)
+
+
+def replica_probs(model: EnglishSTT, audios: List[torch.Tensor]) -> Tuple[List[torch.Tensor], float]:
+    """Replica task: compute_probs moved to cpu for the trip back, and the seconds it took"""
+    start = time.perf_counter()
+    probs = [item_probs.cpu() for item_probs in compute_probs(model, audios)]
+    return probs, time.perf_counter() - start
+
+
+def check_runtime_config(cfg: RuntimeConfig) -> None:
+    """Raises ValueError for parameters that have the right types but that ASRProducer cannot run with"""
+    if cfg.decoder not in ("beam", "greedy"):
+        raise ValueError(f"Unsupported decoder: {cfg.decoder}, expected beam or greedy")
+
+
+def load_prettifier() -> Prettifier:
+    """Loads the punctuation and spelling models from config"""
+    start = time.perf_counter()
+    prettifier = Prettifier(
+        config["postprocessing"]["sentence_gap"],
+        batch_size=config["postprocessing"]["punctuation_batch_size"],
+    )
+    logger.info(f"Loaded punctuation model in {time.perf_counter() - start:.1f}s")
+    return prettifier
 
-    def __init__(self, cfg: RuntimeConfig):
+
+class ASRProducer(TagMessageProducer):
+    """
+    Args:
+        cfg: Runtime parameters of the job
+        metrics: Where to record stage timings, if enabled
+        model: Already loaded STT model to use instead of loading one, e.g. shared by the jobs of a server
+        prettifier: Already loaded Prettifier to use instead of loading one, only loaded if cfg needs it
+        replicas: Already started replicas to run the acoustic model on, started from config if None and configured
+    """
+
+    def __init__(
+        self,
+        cfg: RuntimeConfig,
+        metrics: Optional[StageMetrics] = None,
+        model: Optional[EnglishSTT] = None,
+        prettifier: Optional[Prettifier] = None,
+        replicas: Optional[ReplicaPool] = None,
+    ):
+        check_runtime_config(cfg)
         self.cfg = cfg
-        self.model = EnglishSTT(config["asr_model"], config["lm_model"])
-        self.prettifier = Prettifier(config["postprocessing"]["sentence_gap"])
+        self.metrics = metrics
+        self.model = model if model is not None else load_stt()
+        self.prettifier = prettifier
+        if self.prettifier is None and (cfg.prettify or cfg.pretty_trail):
+            self.prettifier = load_prettifier()
+        self.prefetch_batches = max(config["inference"]["prefetch_batches"], 1)
+        self.post_workers = max(config["inference"]["post_workers"], 1)
+        self.decode_pool = ThreadPoolExecutor(max_workers=config["inference"]["decode_workers"])
+        self.post_pool = ThreadPoolExecutor(max_workers=self.post_workers)
+        # files hinted by prefetch() ahead of the produce() call that will process them
+        self.prefetch_files = max(config["inference"]["live_prefetch_files"], 0)
+        self.prefetch_memory = config["inference"]["live_prefetch_memory_mb"] * 1024 * 1024
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_hints: "OrderedDict[str, None]" = OrderedDict()
+        self.prefetched: Dict[str, Future] = {}
+        self.cache = self._build_cache() if config["cache"]["enabled"] else None
+        # replicas started here are stopped by close(), ones passed in belong to the caller
+        self.own_replicas = replicas is None and len(config["inference"]["replicas"]) > 0
+        self.replicas = start_replicas() if self.own_replicas else replicas
+        # sized for a window plus one file of overshoot, it grows if a window turns out longer
+        initial_frames = math.ceil(2 * self.cfg.pretty_trail_buffer / FRAME_SIZE)
+        # in incremental mode an unfinished sentence and its files stay here until a later produce() call finishes it
+        self.trail = TrailBuffer(initial_frames) if self.cfg.pretty_trail else None
+
+    def close(self) -> None:
+        """Stops the worker threads and owned replicas, the models are left loaded"""
+        self.decode_pool.shutdown()
+        self.post_pool.shutdown()
+        if self.own_replicas:
+            self.replicas.close()
+
+    def finish(self) -> Iterator[Message]:
+        """Emits the unfinished sentence carried over from the last produce() call, once no more files are coming"""
+        if self.trail is not None and not self.trail.is_empty():
+            yield from self._emit_prettified_trail(self.trail, final=True)
+
+    def prefetch(self, files: List[str]) -> None:
+        """
+        Starts decoding the audio of files that will be passed to a later produce() call
+
+        At most live_prefetch_files files are decoded ahead, and no more are started while the decoded audio held
+        exceeds live_prefetch_memory_mb. The remaining files are started as earlier ones are consumed.
+        """
+        if self.prefetch_files == 0:
+            return
+        with self.prefetch_lock:
+            for fname in files:
+                if fname not in self.prefetched:
+                    self.prefetch_hints[fname] = None
+            self._fill_prefetch()
 
     def produce(self, files: List[str]) -> Iterator[Message]:
-        buffer = AudioBuffer() if self.cfg.pretty_trail else None
-        pending_files: List[str] = []
+        buffer = self.trail
+        if self.cfg.decoder == "beam":
+            # the model may be shared with jobs that used other parameters
+            self.model.set_beam_params(self.cfg.beam_width, self.cfg.alpha, self.cfg.beta)
+
+        for res in self._run_pipeline(files):
+            yield from self._emit_transcription(res, buffer)
+
+        # Finalize: flush remaining buffer, except for an unfinished sentence the next files may finish
+        if self.cfg.pretty_trail and buffer is not None and not buffer.is_empty():
+            yield from self._emit_prettified_trail(buffer, final=not self.cfg.pretty_trail_incremental)
+
+        if self.cache is not None:
+            logger.info(f"Result cache: {self.cache.hits} hits, {self.cache.misses} misses")
+        if self.metrics is not None:
+            self.metrics.flush()
+
+    def _build_cache(self) -> ResultCache:
+        # everything besides the audio that changes the cached tags or probs
+        settings = {
+            "runtime": asdict(self.cfg),
+            "postprocessing": config["postprocessing"],
+            "inference": {
+                k: config["inference"][k] for k in ("chunk_length", "chunk_overlap", "quantize", "precision")
+            },
+            "vad": config["vad"],
+        }
+        return ResultCache(
+            os.path.expanduser(config["cache"]["path"]),
+            config["cache"]["max_size_mb"] * 1024 * 1024,
+            cache_namespace([config["asr_model"], config["lm_model"]], settings),
+        )
+
+    def _fill_prefetch(self) -> None:
+        """Starts decoding hinted files while under the prefetch depth and memory budget, prefetch_lock must be held"""
+        while self.prefetch_hints and len(self.prefetched) < self.prefetch_files:
+            if self._prefetched_bytes() >= self.prefetch_memory:
+                break
+            fname, _ = self.prefetch_hints.popitem(last=False)
+            self.prefetched[fname] = self.decode_pool.submit(self._decode_file, fname)
+
+    def _prefetched_bytes(self) -> int:
+        held = 0
+        for future in self.prefetched.values():
+            if future.done():
+                audio = future.result().audio
+                if audio is not None:
+                    held += audio.numel() * audio.element_size()
+        return held
+
+    def _submit_decode(self, fname: str) -> Future:
+        """Returns the prefetched decode of fname if there is one, otherwise submits it to decode_pool"""
+        if self.prefetch_files == 0:
+            return self.decode_pool.submit(self._decode_file, fname)
+        with self.prefetch_lock:
+            future = self.prefetched.pop(fname, None)
+            self.prefetch_hints.pop(fname, None)
+            self._fill_prefetch()
+        if future is None:
+            future = self.decode_pool.submit(self._decode_file, fname)
+        return future
+
+    def _run_pipeline(self, files: List[str]) -> Iterator[Transcription]:
+        """
+        Yields the transcription of each file in input order, with the stages of consecutive batches overlapping
+
+        Audio of the next batches is decoded in decode_pool while the current batch runs through the acoustic model on
+        this thread, and beam search + prettification of the previous batches run in post_pool meanwhile. Both queues
+        are bounded, so at most prefetch_batches batches of audio are held in memory, plus whatever was decoded ahead by
+        prefetch(). With replicas, batches are handed to them instead and up to one per replica is in flight.
+        """
+        batch_size = self.model.batch_size
+        batches = iter([files[i:i + batch_size] for i in range(0, len(files), batch_size)])
+        decoding: Deque[List[Future]] = deque()
+        postprocessing: Deque[Future] = deque()
+        in_flight = self.post_workers + (len(self.replicas) if self.replicas is not None else 0)
+
+        def submit_decode():
+            batch = next(batches, None)
+            if batch is not None:
+                decoding.append([self._submit_decode(fname) for fname in batch])
+
+        for _ in range(self.prefetch_batches):
+            submit_decode()
+
+        while decoding:
+            batch = [future.result() for future in decoding.popleft()]
+            submit_decode()
+            if self.metrics is not None:
+                self.metrics.set_queue_depth("decode", len(decoding))
+                self.metrics.set_queue_depth("post", len(postprocessing))
+                self.metrics.set_queue_depth("prefetch", len(self.prefetched))
+            if self.replicas is None:
+                self._infer(batch)
+                postprocessing.append(self.post_pool.submit(self._postprocess, batch))
+            else:
+                postprocessing.append(self._infer_on_replicas(batch))
+            # only wait on beam search once every post worker and replica has a batch queued
+            while postprocessing and (postprocessing[0].done() or len(postprocessing) > in_flight):
+                yield from postprocessing.popleft().result()
+
+        while postprocessing:
+            yield from postprocessing.popleft().result()
+
+    def _decode_file(self, fname: str) -> Transcription:
+        """Decode stage, runs in decode_pool"""
+        res = Transcription(fname=fname)
+        if self.cache is not None:
+            res = self._lookup_cache(fname)
+            if res.cached:
+                return res
+
+        start = time.perf_counter()
+        try:
+            res.audio, res.duration = audio_file_to_tensor(fname, self.cfg.audio_stream)
+        except Exception as e:
+            res.error = e
+        res.timings["decode"] = time.perf_counter() - start
+        return res
+
+    def _lookup_cache(self, fname: str) -> Transcription:
+        start = time.perf_counter()
+        res = Transcription(fname=fname)
+        try:
+            res.cache_key = self.cache.key(fname)
+        except OSError:
+            # unreadable files are reported by the decode stage
+            return res
+        hit = self.cache.get(res.cache_key, need_probs=self.cfg.pretty_trail)
+        if hit is not None:
+            res.duration = hit.duration
+            res.probs = hit.probs
+            res.tags = hit.tags
+            res.output_tags = hit.output_tags
+            res.cached = True
+        res.timings["cache"] = time.perf_counter() - start
+        return res
+
+    def _store_cache(self, batch: List[Transcription]) -> None:
+        for res in batch:
+            if res.error is not None or res.cache_key is None:
+                continue
+            result = CachedResult(
+                duration=res.duration,
+                tags=res.tags,
+                output_tags=res.output_tags,
+                probs=res.probs if self.cfg.pretty_trail else None,
+            )
+            try:
+                self.cache.put(res.cache_key, result)
+            except Exception as e:
+                logger.warning(f"Failed to cache the result of {res.fname}: {e}")
+
+    def _infer(self, batch: List[Transcription]) -> None:
+        """Acoustic model stage, runs on the producer thread so the model is never shared between threads"""
+        decoded = [res for res in batch if res.error is None and not res.cached]
+        if len(decoded) == 0:
+            return
 
-        for fname in files:
+        start = time.perf_counter()
+        try:
+            probs = compute_probs(self.model, [res.audio for res in decoded])
+            for res, item_probs in zip(decoded, probs):
+                res.probs = item_probs
+        except Exception as e:
+            for res in decoded:
+                res.error = e
+        finally:
+            for res in decoded:
+                res.audio = None
+        _split_time(decoded, "infer", time.perf_counter() - start)
+
+    def _infer_on_replicas(self, batch: List[Transcription]) -> Future:
+        """Acoustic model stage on the replicas, the returned future resolves once the batch is also postprocessed"""
+        done: Future = Future()
+        decoded = [res for res in batch if res.error is None and not res.cached]
+
+        def postprocess():
             try:
-                audio_tensor, duration = audio_file_to_tensor(fname)
-                tags = self.model.tag(audio_tensor)
-
-                if len(tags) > 0:
-                    output_tags = self._format_tags(tags)
-                    augmented = self._add_augmented_fields(output_tags, fname, None)
-                    yield from self._tags_to_messages(augmented)
-                elif not self.cfg.pretty_trail:
-                    yield ProgressMessage(
-                        type="progress",
-                        data=Progress(source_media=fname),
-                    )
-
-                if self.cfg.pretty_trail and buffer is not None:
-                    buffer.add(audio_tensor, duration)
-                    pending_files.append(fname)
-
-                    if buffer.is_ready(self.cfg.pretty_trail_buffer):
-                        yield from self._emit_prettified_trail(buffer, pending_files)
-                        pending_files = []
-                        buffer.clear()
+                done.set_result(self._postprocess(batch))
+            except Exception as e:
+                done.set_exception(e)
 
+        def on_probs(future: Future):
+            try:
+                probs, elapsed = future.result()
+                for res, item_probs in zip(decoded, probs):
+                    res.probs = item_probs
+                _split_time(decoded, "infer", elapsed)
             except Exception as e:
-                logger.opt(exception=e).error(f"Error processing file {fname}")
-                yield ErrorMessage(
-                    type="error",
-                    data=Error(source_media=fname, message=str(e)),
+                for res in decoded:
+                    res.error = e
+            self.post_pool.submit(postprocess)
+
+        if len(decoded) == 0:
+            self.post_pool.submit(postprocess)
+            return done
+        audios = [res.audio for res in decoded]
+        for res in decoded:
+            res.audio = None
+        try:
+            self.replicas.submit(audios).add_done_callback(on_probs)
+        except Exception as e:
+            for res in decoded:
+                res.error = e
+            self.post_pool.submit(postprocess)
+        return done
+
+    def _postprocess(self, batch: List[Transcription]) -> List[Transcription]:
+        """Beam search and prettification stage, runs in post_pool"""
+        inferred = [res for res in batch if res.error is None and not res.cached]
+        if len(inferred) == 0:
+            return batch
+
+        start = time.perf_counter()
+        try:
+            tags = self.model.tag_probs_batch([res.probs for res in inferred], decoder=self.cfg.decoder)
+        except Exception as e:
+            for res in inferred:
+                res.error = e
+            return batch
+        finally:
+            _split_time(inferred, "beamsearch", time.perf_counter() - start)
+
+        for res, file_tags in zip(inferred, tags):
+            res.tags = file_tags
+
+        tagged = [res for res in inferred if len(res.tags) > 0]
+        start = time.perf_counter()
+        try:
+            for res, output_tags in zip(tagged, self._format_tags_batch([res.tags for res in tagged])):
+                res.output_tags = output_tags
+        except Exception as e:
+            for res in tagged:
+                res.error = e
+        _split_time(tagged, "prettify", time.perf_counter() - start)
+
+        if self.cache is not None:
+            self._store_cache(inferred)
+        return batch
+
+    def _emit_transcription(self, res: Transcription, buffer: Optional[TrailBuffer]) -> Iterator[Message]:
+        fname = res.fname
+        if self.metrics is not None:
+            error = str(res.error) if res.error is not None else None
+            self.metrics.record_file(fname, res.duration, res.timings, error)
+            if res.cache_key is not None:
+                self.metrics.record_cache_lookup(res.cached)
+        try:
+            if res.error is not None:
+                raise res.error
+
+            if len(res.tags) > 0:
+                augmented = self._add_augmented_fields(res.output_tags, fname, None)
+                yield from self._tags_to_messages(augmented)
+            elif not self.cfg.pretty_trail:
+                yield ProgressMessage(
+                    type="progress",
+                    data=Progress(source_media=fname),
                 )
 
-        # Finalize: flush remaining buffer
-        if self.cfg.pretty_trail and buffer is not None and not buffer.is_empty():
-            yield from self._emit_prettified_trail(buffer, pending_files)
+            if self.cfg.pretty_trail and buffer is not None:
+                buffer.add(fname, res.probs, res.tags, res.duration)
+
+                if buffer.is_ready(self.cfg.pretty_trail_buffer):
+                    yield from self._emit_prettified_trail(buffer)
 
-    def _format_tags(self, tags: List[ModelTag]) -> List[ModelTag]:
+        except Exception as e:
+            logger.opt(exception=e).error(f"Error processing file {fname}")
+            yield ErrorMessage(
+                type="error",
+                data=Error(source_media=fname, message=str(e)),
+            )
+
+    def _format_tags_batch(self, tag_lists: List[List[ModelTag]]) -> List[List[ModelTag]]:
+        if len(tag_lists) == 0:
+            return []
         if self.cfg.prettify:
-            tags = self.prettifier.prettify(tags)
+            tag_lists = self.prettifier.prettify_batch(tag_lists)
         if not self.cfg.word_level:
-            combined = combine_tags(tags)
-            return [combined]
-        return tags
+            return [[combine_tags(tags)] for tags in tag_lists]
+        return tag_lists
 
     def _add_augmented_fields(
         self, tags: List[ModelTag], fname: str, track: Optional[str]
@@ -124,63 +654,169 @@ class ASRProducer(TagMessageProducer):
 
     def _tags_to_messages(self, tags: List[AugmentedTag]) -> Iterator[TagMessage]:
         for tag in tags:
-            data = asdict(tag)
-            data = {k: v for k, v in data.items() if v is not None}
             yield TagMessage(
                 type="tag",
-                data=Tag(**data),
+                data=Tag(
+                    start_time=tag.start_time,
+                    end_time=tag.end_time,
+                    tag=tag.tag,
+                    source_media=tag.source_media,
+                    # a missing track falls back to Tag's default
+                    track=tag.track if tag.track is not None else "",
+                ),
             )
 
-    def _emit_prettified_trail(
-        self, buffer: AudioBuffer, pending_files: List[str]
-    ) -> Iterator[Message]:
-        if buffer.is_empty() or len(pending_files) == 0:
+    def _emit_prettified_trail(self, buffer: TrailBuffer, final: bool = False) -> Iterator[Message]:
+        """
+        Emit the captions of a trail window and start the next one. In incremental mode the unfinished last sentence
+        is carried over with its files unless this is the final window or it has been waiting too long.
+        """
+        if buffer.is_empty():
             return
 
-        combined_tensor = buffer.get_combined_tensor()
+        pending_files = buffer.files()
         first_fname = pending_files[0]
 
-        tags = self.model.tag(combined_tensor)
+        start = time.perf_counter()
+        tags = self._stitch_trail_tags(buffer)
+        incremental = self.cfg.pretty_trail_incremental and not final
+        sentence_tags = []
+        carry_from = None
         if tags:
-            prettified_tags = self.prettifier.prettify(tags)
-            sentence_tags = self._merge_to_sentences(prettified_tags)
-            augmented = self._add_augmented_fields(sentence_tags, first_fname, "auto_captions")
-
-            yield from self._tags_to_messages(augmented)
-
-        for fname in pending_files:
+            # words emitted with the previous window are still prettified, as context for the ones after them
+            prettified_tags = self.prettifier.prettify(tags, open_ended=incremental)
+            sentence_tags = merge_to_sentences([t for t in prettified_tags if t.start_time >= buffer.emitted_until])
+        if incremental and sentence_tags:
+            tail = sentence_tags[-1]
+            waited = buffer.total_duration - tail.start_time / 1000
+            if not tail.tag.endswith(('.', '?', '!')) and waited < self.cfg.pretty_trail_max_latency:
+                sentence_tags = sentence_tags[:-1]
+                carry_from = tail.start_time
+        augmented = self._add_augmented_fields(sentence_tags, first_fname, "auto_captions")
+        if self.metrics is not None:
+            self.metrics.add_stage_time("trail", time.perf_counter() - start)
+
+        yield from self._tags_to_messages(augmented)
+
+        if carry_from is None:
+            buffer.clear()
+        else:
+            buffer.carry_over(carry_from, tags)
+        # files still in the buffer get their progress message with the window that finishes them
+        for fname in pending_files[:len(pending_files) - len(buffer.segments)]:
             yield ProgressMessage(
                 type="progress",
                 data=Progress(source_media=fname),
             )
 
-    def _merge_to_sentences(self, tags: List[ModelTag]) -> List[ModelTag]:
-        if len(tags) == 0:
+    def _stitch_trail_tags(self, buffer: TrailBuffer) -> List[ModelTag]:
+        """
+        Combine the first-pass tags of each file into a single timeline relative to the start of the trail window.
+
+        Words close to a file boundary were decoded with only one side of it, so the probs around each boundary
+        are re-decoded and replace the per-file words there. Files carried over from the previous window keep the
+        words that window decoded, up to where its last file ended without a boundary after it.
+        """
+        context = max(self.cfg.pretty_trail_boundary * 1000, 0)
+        if len(buffer.carried) == 0:
+            return self._stitch_segments(buffer, buffer.segments, context)
+
+        # only the last carried file, which had no boundary after it yet, is stitched again with the new ones. The
+        # previous window's words are cut from it where neither decode has a word and both saw both sides of a boundary
+        until = buffer.carried_until
+        last = max(i for i, seg in enumerate(buffer.segments) if seg.offset < until)
+        first = buffer.segments[last].offset
+        stitched = self._stitch_segments(buffer, buffer.segments[last:], context)
+        lo = max(buffer.emitted_until, first)
+        cut = _agreed_cut([buffer.carried, stitched], lo, until, max(until - context, (first + until) / 2))
+        return [t for t in buffer.carried if t.start_time < cut] + [t for t in stitched if t.start_time >= cut]
+
+    def _stitch_segments(self, buffer: TrailBuffer, segments: List[TrailSegment], context: float) -> List[ModelTag]:
+        if context <= 0:
+            return [tag for seg in segments for tag in self._shift_tags(seg.tags, seg.offset)]
+
+        # the decodes in timeline order, alternating between first-pass and boundary ones, each with the time where
+        # the cut to the next one would ideally go
+        pieces: List[Tuple[List[ModelTag], float]] = []
+        for i, seg in enumerate(segments):
+            if i > 0:
+                pieces.append((self._decode_boundary(buffer, segments[i - 1], seg), seg.offset + context))
+            if i + 1 == len(segments):
+                pieces.append((self._shift_tags(seg.tags, seg.offset), math.inf))
+            elif i > 0 and segments[i + 1].offset - context < seg.offset + context:
+                # file is shorter than the boundary context, split it between its two boundary windows
+                pieces[-1] = (pieces[-1][0], (seg.offset + segments[i + 1].offset) / 2)
+            else:
+                pieces.append((self._shift_tags(seg.tags, seg.offset), segments[i + 1].offset - context))
+
+        # every word is taken whole from one decode: the cut between two decodes is placed where neither has a word
+        stitched = []
+        lo = -math.inf
+        for k, (tags, ideal) in enumerate(pieces):
+            hi = math.inf
+            if k + 1 < len(pieces):
+                hi = _agreed_cut([tags, pieces[k + 1][0]], max(lo, ideal - context / 2), ideal + context / 2, ideal)
+            stitched.extend(t for t in tags if lo <= t.start_time < hi)
+            lo = hi
+
+        return stitched
+
+    def _decode_boundary(self, buffer: TrailBuffer, prev: TrailSegment, nxt: TrailSegment) -> List[ModelTag]:
+        """Re-decode the probs around the boundary between two consecutive files"""
+        num_frames = math.ceil(2 * self.cfg.pretty_trail_boundary / FRAME_SIZE)
+        frame_ms = FRAME_SIZE * 1000
+        tail_frames = min(num_frames, prev.probs.size(1))
+        head_frames = min(num_frames, nxt.probs.size(1))
+        if tail_frames + head_frames == 0:
             return []
 
-        sentence_delimiters = {'.', '?', '!'}
-        sentences = []
-        current_words = []
-        current_start = tags[0].start_time
-
-        for i, tag in enumerate(tags):
-            current_words.append(tag.tag)
+        split = tail_frames * frame_ms
+        tail_offset = prev.offset + (prev.probs.size(1) - tail_frames) * frame_ms
+        # consecutive files are adjacent in the buffer, so the window across the boundary needs no copy
+        window = buffer.frames(nxt.first_frame - tail_frames, nxt.first_frame + head_frames)
+        tags = self.model.tag_probs(window, decoder=self.cfg.decoder)
 
-            if any(tag.tag.endswith(delim) for delim in sentence_delimiters):
-                sentences.append(ModelTag(
-                    start_time=current_start,
-                    end_time=tag.end_time,
-                    tag=' '.join(current_words),
-                ))
-                current_words = []
-                if i + 1 < len(tags):
-                    current_start = tags[i + 1].start_time
-
-        if current_words:
-            sentences.append(ModelTag(
-                start_time=current_start,
-                end_time=tags[-1].end_time,
-                tag=' '.join(current_words),
+        shifted = []
+        for tag in tags:
+            shift = tail_offset if tag.start_time < split else nxt.offset - split
+            shifted.append(ModelTag(
+                start_time=round(tag.start_time + shift),
+                end_time=round(tag.end_time + shift),
+                tag=tag.tag,
             ))
+        return shifted
+
+    def _shift_tags(self, tags: List[ModelTag], offset: int) -> List[ModelTag]:
+        return [
+            ModelTag(start_time=tag.start_time + offset, end_time=tag.end_time + offset, tag=tag.tag)
+            for tag in tags
+        ]
+
 
-        return sentences
+def _agreed_cut(decodes: List[List[ModelTag]], lo: float, hi: float, ideal: float) -> float:
+    """
+    The time in [lo, hi] closest to ideal that no word of any of the decodes spans, a word edge at the latest, so that
+    words starting before the cut can be taken from one decode and the ones after it from another without a word
+    being dropped or taken twice. ideal clamped to [lo, hi] if the words leave no such time.
+    """
+    spans = sorted(
+        (t.start_time, t.end_time) for tags in decodes for t in tags if t.end_time > lo and t.start_time < hi)
+    free: List[Tuple[float, float]] = []
+    cursor = lo
+    for start, end in spans:
+        if start >= cursor:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor <= hi:
+        free.append((cursor, hi))
+    if len(free) == 0:
+        return min(max(ideal, lo), hi)
+    return min((min(max(ideal, a), b) for a, b in free), key=lambda t: abs(t - ideal))
+
+
+def _split_time(batch: List[Transcription], stage: str, elapsed: float) -> None:
+    """Attribute the wall time of a batched stage to its files in proportion to their audio duration"""
+    total = sum(res.duration for res in batch)
+    for res in batch:
+        share = res.duration / total if total > 0 else 1 / len(batch)
+        res.timings[stage] = res.timings.get(stage, 0.0) + elapsed * share
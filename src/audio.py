@@ -1,46 +1,97 @@
 import torch
-import librosa
-import io
+import numpy as np
 import ffmpeg
-from typing import Tuple
+import threading
+from typing import BinaryIO, Optional, Tuple
 
 SAMPLE_RATE = 16000
+# initial size of the decode buffer, it doubles whenever a file is longer than that
+INITIAL_BUFFER_SECONDS = 30
 
-def audio_file_to_tensor(fname: str) -> Tuple[torch.Tensor, float]:
+def audio_file_to_tensor(fname: str, audio_stream: Optional[int] = None) -> Tuple[torch.Tensor, float]:
     """
-    Convert audio file bytes to tensor
+    Decode an audio file to a mono 16kHz float32 tensor
     
     Args:
-        audio_bytes: Raw audio file bytes (any format supported by ffmpeg)
+        fname: Path to the audio or video file (any format supported by ffmpeg, detected from its contents)
+        audio_stream: Index of the audio stream to decode among the file's audio streams, ffmpeg picks the best one
+            if None
     
     Returns:
         Tuple of (audio_tensor, duration_in_seconds)
         audio_tensor has shape (1, num_samples)
     """
-    # Convert to WAV first
-    with open(fname, 'rb') as f:
-        audio_bytes = f.read()
-
-    wav_bytes = _to_wav(audio_bytes)
-    
-    # Load as numpy array
-    audio, sr = librosa.load(io.BytesIO(wav_bytes), sr=SAMPLE_RATE, mono=True)
-    duration = librosa.get_duration(y=audio, sr=sr)
+    audio = _decode_pcm(fname, audio_stream)
+    duration = len(audio) / SAMPLE_RATE
     
-    # Convert to tensor
-    audio_tensor = torch.Tensor(audio).unsqueeze(0)
+    # shares memory with the decode buffer
+    audio_tensor = torch.from_numpy(audio).unsqueeze(0)
     
     return audio_tensor, duration
 
-def _to_wav(audio: bytes) -> bytes:
-    """Convert any audio format to WAV using ffmpeg"""
+def _decode_pcm(fname: str, audio_stream: Optional[int] = None) -> np.ndarray:
+    """Stream the f32le samples of every channel from ffmpeg straight into a preallocated numpy buffer, then average
+    the channels"""
+    # ffmpeg reads the path itself, so it probes the container format and only demuxes the packets it needs
+    stream = ffmpeg.input(fname)
+    if audio_stream is not None:
+        stream = stream[f'a:{audio_stream}']
     process = (
-        ffmpeg
-        .input('pipe:0', f='mov,mp4,m4a,3gp,3g2,mj2')
-        .output('pipe:1', format='wav')
-        .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+        stream
+        # video, subtitle and data streams are never decoded. The channels are kept and averaged here: ffmpeg's own
+        # downmix (-ac 1) weighs both stereo channels by 0.707, which is 3dB louder than the audio the model expects
+        .output('pipe:1', format='wav', acodec='pcm_f32le', ar=SAMPLE_RATE, vn=None, sn=None, dn=None)
+        .global_args('-nostdin', '-loglevel', 'error')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
     )
-    out, err = process.communicate(input=audio)
+
+    # stderr is drained while stdout is read, a full stderr pipe would otherwise block ffmpeg and this loop with it
+    err = []
+    drain = threading.Thread(target=lambda: err.append(process.stderr.read()), daemon=True)
+    drain.start()
+
+    # a failed decode writes no header and is reported from ffmpeg's exit code below
+    channels = _read_wav_channels(process.stdout)
+    buf = np.empty(INITIAL_BUFFER_SECONDS * SAMPLE_RATE * max(channels, 1), dtype=np.float32)
+    filled = 0
+    while channels > 0:
+        if filled == buf.nbytes:
+            grown = np.empty(2 * len(buf), dtype=np.float32)
+            grown[:len(buf)] = buf
+            buf = grown
+        n = process.stdout.readinto(buf.view(np.uint8)[filled:])
+        if not n:
+            break
+        filled += n
+
+    process.wait()
+    drain.join()
     if process.returncode != 0:
-        raise Exception(f"ffmpeg error: {err.decode()}")
-    return out
\ No newline at end of file
+        raise Exception(f"ffmpeg error: {err[0].decode() if err else ''}")
+    if channels == 0:
+        raise Exception("ffmpeg error: no audio in the output")
+    samples = buf[:filled // (buf.itemsize * channels) * channels]
+    if channels > 1:
+        return samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    if len(samples) == len(buf):
+        return buf
+    # a copy of the samples rather than a view, which would keep the whole buffer, up to twice the audio, alive
+    return samples.copy()
+
+def _read_wav_channels(stdout: BinaryIO) -> int:
+    """Read the WAV header ffmpeg writes up to the first sample, returns the number of channels, 0 without a header"""
+    if len(stdout.read(12)) < 12:
+        return 0
+    channels = 0
+    while True:
+        header = stdout.read(8)
+        if len(header) < 8:
+            return 0
+        chunk_id, size = header[:4], int.from_bytes(header[4:], 'little')
+        if chunk_id == b'data':
+            # its size is left unset when writing to a pipe, the samples run until EOF
+            return channels
+        # chunks are padded to an even size
+        body = stdout.read(size + size % 2)
+        if chunk_id == b'fmt ':
+            channels = int.from_bytes(body[2:4], 'little')
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import torch
+from loguru import logger
+
+from src.tags import ModelTag
+
+# files are hashed in blocks of this many bytes so large media is never read into memory at once
+HASH_BLOCK_SIZE = 1 << 20
+
+@dataclass
+class CachedResult:
+    """First-pass STT output of a single file, as stored in the cache"""
+    duration: float
+    # raw word-level tags, relative to the start of the file
+    tags: List[ModelTag]
+    # tags as emitted on the default track
+    output_tags: List[ModelTag]
+    # acoustic model output, shape (1, num_frames, vocab_size), only stored when the trail may need it
+    probs: Optional[torch.Tensor] = None
+
+def cache_namespace(model_paths: List[str], settings: Dict[str, Any]) -> str:
+    """
+    Fingerprint of everything besides the audio that the cached results depend on
+
+    Model files are identified by path, size and modification time rather than by content, so starting up does not
+    read several GB of weights. Replacing a model file in place therefore invalidates the cache as expected.
+
+    Args:
+        model_paths: Model files or directories of model files
+        settings: Any JSON serializable settings that change the output
+
+    Returns:
+        Hex digest that is mixed into every cache key
+    """
+    h = hashlib.sha256()
+    for path in model_paths:
+        path = os.path.realpath(path)
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+        else:
+            files = [path]
+        for f in files:
+            try:
+                st = os.stat(f)
+                h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+            except OSError:
+                h.update(f"{f}:missing\n".encode())
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    On-disk cache of per-file STT results keyed by the content hash of the media file
+
+    Entries are single files under path, evicted least recently used first once their total size exceeds max_bytes.
+    Recency survives restarts through the entries' modification times, which are bumped on every hit.
+
+    Args:
+        path: Directory holding the entries, created if missing
+        max_bytes: Size bound for all entries together
+        namespace: Fingerprint of the models and settings, see cache_namespace
+    """
+    def __init__(self, path: str, max_bytes: int, namespace: str):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+        # key -> entry size in bytes, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        found = []
+        for name in os.listdir(path):
+            if not name.endswith(".pt"):
+                continue
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime_ns, name[:-len(".pt")], st.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        # the size bound may have been lowered since the last run
+        self._evict()
+        logger.info(f"Result cache at {path} holds {len(self.entries)} entries ({self.total_bytes / 2**20:.1f} MB)")
+
+    def key(self, fname: str) -> str:
+        h = hashlib.sha256(self.namespace.encode())
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def get(self, key: str, need_probs: bool=False) -> Optional[CachedResult]:
+        """
+        Args:
+            key: Cache key of the file, see key()
+            need_probs: Treat entries stored without acoustic model output as misses
+
+        Returns:
+            The cached result, or None on a miss
+        """
+        entry_path = self._entry_path(key)
+        result = None
+        try:
+            data = torch.load(entry_path, map_location="cpu")
+            if data["probs"] is not None or not need_probs:
+                result = CachedResult(
+                    duration=data["duration"],
+                    tags=[ModelTag(*t) for t in data["tags"]],
+                    output_tags=[ModelTag(*t) for t in data["output_tags"]],
+                    probs=data["probs"],
+                )
+                os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {entry_path}: {e}")
+            with self.lock:
+                self._remove(key)
+
+        with self.lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: CachedResult) -> None:
+        entry_path = self._entry_path(key)
+        # written under a unique name and renamed, so concurrent readers never load a partial entry
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save({
+            "duration": result.duration,
+            "tags": [(t.start_time, t.end_time, t.tag) for t in result.tags],
+            "output_tags": [(t.start_time, t.end_time, t.tag) for t in result.output_tags],
+            # cloned so a slice of a batched forward pass does not drag the whole batch's storage along
+            "probs": result.probs.detach().cpu().clone() if result.probs is not None else None,
+        }, tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, entry_path)
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        """Removes least recently used entries until under max_bytes, keeping at least the newest one"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str) -> None:
+        """Deletes an entry, self.lock must be held"""
+        self.total_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".pt")
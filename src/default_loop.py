@@ -1,11 +1,10 @@
 
-from multiprocessing import Queue
+import os
+import queue
 import sys
 import threading
-import time
 import traceback
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass, asdict
+from typing import List, Optional, Dict, Any, Tuple
 import json
 import argparse
 
@@ -14,36 +13,96 @@ from src.message_producer import *
 class AbortTaggingException(Exception):
     pass
 
-def write_message(msg: Message, fout):
+# same output as json.dumps with default arguments, without re-validating the arguments on every call
+_json_encoder = json.JSONEncoder()
+
+def _message_data(msg: Message) -> Dict[str, Any]:
+    """Field-by-field equivalent of asdict(msg.data), without the recursive deepcopy"""
+    data = msg.data
     if isinstance(msg, TagMessage):
-        fout.write(json.dumps({"type": msg.type, "data": asdict(msg.data)}) + "\n")
+        return {
+            "start_time": data.start_time,
+            "end_time": data.end_time,
+            "tag": data.tag,
+            "source_media": data.source_media,
+            "track": data.track,
+            "additional_info": data.additional_info,
+        }
     elif isinstance(msg, ProgressMessage):
-        fout.write(json.dumps({"type": msg.type, "data": asdict(msg.data)}) + "\n")
+        return {"source_media": data.source_media}
     elif isinstance(msg, ErrorMessage):
-        fout.write(json.dumps({"type": msg.type, "data": asdict(msg.data)}) + "\n")
-    else:
-        raise ValueError(f"Unnexpected message type: {msg}")
+        return {"message": data.message, "source_media": data.source_media}
+    raise ValueError(f"Unnexpected message type: {msg}")
+
+def encode_message(msg: Message) -> str:
+    """Serializes a message to a single JSONL line, including the trailing newline"""
+    return _json_encoder.encode({"type": msg.type, "data": _message_data(msg)}) + "\n"
+
+def write_message(msg: Message, fout):
+    fout.write(encode_message(msg))
     fout.flush()
 
+class MessageWriter:
+    """
+    Buffers encoded messages and writes them out in one call per flush
+    
+    Tags are held until the next progress or error message, the end of the batch, or until max_buffer characters are
+    pending, so consumers see each file's tags complete together with its progress message.
+    
+    Args:
+        fout: The open output file
+        fsync: Whether to fsync the file at the end of every batch
+        max_buffer: Number of pending characters that forces a write
+    """
+    def __init__(self, fout, fsync: bool=False, max_buffer: int=1 << 20):
+        self.fout = fout
+        self.fsync = fsync
+        self.max_buffer = max_buffer
+        self.pending: List[str] = []
+        self.pending_chars = 0
+
+    def write(self, msg: Message) -> None:
+        line = encode_message(msg)
+        self.pending.append(line)
+        self.pending_chars += len(line)
+        if not isinstance(msg, TagMessage) or self.pending_chars >= self.max_buffer:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.fout.write("".join(self.pending))
+            self.pending = []
+            self.pending_chars = 0
+        self.fout.flush()
+
+    def end_batch(self) -> None:
+        self.flush()
+        if self.fsync:
+            os.fsync(self.fout.fileno())
+
 def start_loop_from_producer(
     producer: TagMessageProducer,
     output_path: str,
     continue_on_error: bool=False,
-    batch_timeout: float=0.2,
     batch_limit: Optional[int]=None,
+    fsync: bool=False,
 ) -> None:
     """
     Live mode: reads file paths from stdin and processes them in batches
     
+    Batches run one at a time. A file arriving while the loop is idle starts a batch right away, and files arriving
+    while a batch runs make up the next one, up to batch_limit files.
+    
     Args:
-        model: The model to use for tagging, can be AVModel, FrameModel, or BatchFrameModel
+        producer: The producer to use for tagging
         output_path: The file path to write the output tags (.jsonl format)
-        batch_timeout: Timeout for batching files
-        fps: Frames per second, only relevant or FrameModel or BatchFrameModel when processing videos
-        allow_single_frame: Whether to allow processing of single-frame videos, only relevant for FrameModel or BatchFrameModel
+        continue_on_error: Whether to keep going after the producer reports an error
+        batch_limit: Maximum number of files per batch, unlimited if None
+        fsync: Whether to fsync the output file after every batch
     """
     
-    file_queue = Queue()
+    # file paths, None once stdin is exhausted
+    file_queue: "queue.Queue[Optional[str]]" = queue.Queue()
     
     def stdin_reader():
         """Thread function to read from stdin and add files to queue"""
@@ -52,20 +111,25 @@ def start_loop_from_producer(
                 line = line.strip()
                 if line:
                     file_queue.put(line)
+                    # lets the producer start on files while the current batch is still running
+                    producer.prefetch([line])
         except (EOFError, KeyboardInterrupt):
             pass
         finally:
             print("Stopping stdin reader", file=sys.stderr)
             file_queue.put(None)
     
-    def process_batch(files, fd):
+    def process_batch(files, writer):
         print(f"Processing batch of {len(files)} files...", file=sys.stderr)
         for fname in files:
             print(f"Got {fname}")
+        write_messages(producer.produce(files), writer)
+        print(f"Completed batch of {len(files)} files", file=sys.stderr)
+
+    def write_messages(messages, writer):
         try:
-            messages = producer.produce(files)
             for msg in messages:
-                write_message(msg, fd)
+                writer.write(msg)
                 if isinstance(msg, ErrorMessage):
                     raise AbortTaggingException("Received an error response from the producer")
         except AbortTaggingException:
@@ -73,44 +137,27 @@ def start_loop_from_producer(
                 # we already wrote the error
                 raise
         except Exception as e:
-            write_message(ErrorMessage(type="error", data=Error(message=str(e))), fd)
+            writer.write(ErrorMessage(type="error", data=Error(message=str(e))))
             if not continue_on_error:
                 raise
-        print(f"Completed batch of {len(files)} files", file=sys.stderr)
+        finally:
+            writer.end_batch()
     
     reader_thread = threading.Thread(target=stdin_reader, daemon=True)
     reader_thread.start()
-    
-    current_batch = []
 
     fdout = open(output_path, 'a')
+    writer = MessageWriter(fdout, fsync=fsync)
     
     while True:
         try:
-            while not file_queue.empty():
-                file_path = file_queue.get_nowait()
-                
-                # last batch
-                if file_path is None:
-                    if current_batch:
-                        process_batch(current_batch, fdout)
-                    fdout.close()
-                    return
-                
-                # add to current batch to process
-                current_batch.append(file_path)
-                if batch_limit is not None and len(current_batch) >= batch_limit:
-                    process_batch(current_batch, fdout)
-                    current_batch = []
-            
-            if current_batch:
-                process_batch(current_batch, fdout)
-                current_batch = []
-            
-            if not reader_thread.is_alive() and file_queue.empty():
+            batch, done = next_batch(file_queue, batch_limit)
+            if batch:
+                process_batch(batch, writer)
+            if done:
+                # captions the producer held back for files that never came
+                write_messages(producer.finish(), writer)
                 break
-            
-            time.sleep(batch_timeout)
         except (KeyboardInterrupt, SystemExit):
             break
         except Exception as e:
@@ -120,6 +167,35 @@ def start_loop_from_producer(
 
     fdout.close()
 
+def next_batch(
+    file_queue: "queue.Queue[Optional[str]]",
+    batch_limit: Optional[int]=None,
+) -> Tuple[List[str], bool]:
+    """
+    Blocks until a file is queued, then takes the files already queued behind it, up to batch_limit
+    
+    The loop only asks for a batch once the previous one is done, so the files that arrived meanwhile are batched
+    together, and a file arriving at an idle loop does not wait for others to join it.
+    
+    Returns:
+        Tuple of (batch, done), done is True once the queue has been closed with None
+    """
+    first = file_queue.get()
+    if first is None:
+        return [], True
+
+    batch = [first]
+    while batch_limit is None or len(batch) < batch_limit:
+        try:
+            item = file_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+
+    return batch, False
+
 def catch_errors():
     parser = argparse.ArgumentParser()
     parser.add_argument('--output-path', required=True, help='Path to write output tags (.jsonl)')
@@ -44,4 +44,12 @@ class ErrorMessage(Message):
 class TagMessageProducer(ABC):
     @abstractmethod
     def produce(self, files: List[str]) -> Iterator[Message]:
-        pass
\ No newline at end of file
+        pass
+
+    def prefetch(self, files: List[str]) -> None:
+        """Hint that files will be passed to a later produce() call, so work on them can start early"""
+        pass
+
+    def finish(self) -> Iterator[Message]:
+        """Messages held back for files that a later produce() call could have affected, called after the last one"""
+        return iter([])
\ No newline at end of file
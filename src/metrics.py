@@ -0,0 +1,91 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+class StageMetrics:
+    """
+    Per-file stage timings written as a JSONL sidecar, plus running totals dumped in the Prometheus text format
+
+    The producer always measures stage wall times (a few clock reads per batch), this only adds the bookkeeping and
+    file writes, so it is only created when metrics are enabled.
+    """
+
+    def __init__(self, jsonl_path: str, prom_path: str):
+        self.jsonl = open(jsonl_path, 'a')
+        self.prom_path = prom_path
+        self.files = 0
+        self.errors = 0
+        self.audio_seconds = 0.0
+        self.stage_seconds: Dict[str, float] = {}
+        self.queue_depth: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def set_queue_depth(self, queue: str, depth: int) -> None:
+        self.queue_depth[queue] = depth
+
+    def add_stage_time(self, stage: str, seconds: float) -> None:
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def record_cache_lookup(self, hit: bool) -> None:
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def record_file(self, fname: str, duration: float, timings: Dict[str, float], error: Optional[str] = None) -> None:
+        """
+        Args:
+            fname: source media
+            duration: audio duration in seconds
+            timings: wall time in seconds spent on the file per stage, batched stages are split by audio duration
+            error: error message if the file failed
+        """
+        self.files += 1
+        self.audio_seconds += duration
+        if error is not None:
+            self.errors += 1
+        for stage, seconds in timings.items():
+            self.add_stage_time(stage, seconds)
+
+        processing = sum(timings.values())
+        record = {
+            "source_media": fname,
+            "duration": duration,
+            "stages": timings,
+            "processing_time": processing,
+            "rtf": processing / duration if duration > 0 else None,
+            "queue_depth": dict(self.queue_depth),
+        }
+        if error is not None:
+            record["error"] = error
+        self.jsonl.write(json.dumps(record) + "\n")
+
+    def flush(self) -> None:
+        self.jsonl.flush()
+        lines: List[str] = [
+            "# TYPE asr_files_total counter",
+            f"asr_files_total {self.files}",
+            "# TYPE asr_errors_total counter",
+            f"asr_errors_total {self.errors}",
+            "# TYPE asr_audio_seconds_total counter",
+            f"asr_audio_seconds_total {self.audio_seconds}",
+            "# TYPE asr_cache_hits_total counter",
+            f"asr_cache_hits_total {self.cache_hits}",
+            "# TYPE asr_cache_misses_total counter",
+            f"asr_cache_misses_total {self.cache_misses}",
+            "# TYPE asr_stage_seconds_total counter",
+        ]
+        lines += [f'asr_stage_seconds_total{{stage="{stage}"}} {seconds}' for stage, seconds in self.stage_seconds.items()]
+        lines.append("# TYPE asr_queue_depth gauge")
+        lines += [f'asr_queue_depth{{queue="{queue}"}} {depth}' for queue, depth in self.queue_depth.items()]
+
+        # readers scraping the file never see a partial dump
+        tmp_path = self.prom_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+    def close(self) -> None:
+        self.flush()
+        self.jsonl.close()
@@ -1,29 +1,88 @@
-from typing import List
-from deepmultilingualpunctuation import PunctuationModel
+from typing import List, Tuple, Dict, Any, Optional
+import threading
+import torch
 from src.tags import ModelTag
 
+# chunking used by PunctuationModel.predict, texts longer than this many words are split into overlapping chunks
+PUNCTUATION_CHUNK_SIZE = 230
+PUNCTUATION_CHUNK_OVERLAP = 5
+
 class Prettifier:
     """Handles text correction, punctuation, and capitalization"""
     
-    def __init__(self, max_gap: int):
-        self.punctuation_model = PunctuationModel()
+    def __init__(self, max_gap: int, batch_size: int = 16, punctuation_model: Optional[Any] = None):
+        """
+        Args:
+            max_gap: Maximum gap in ms to consider words part of same sentence
+            batch_size: Maximum number of sentence chunks per punctuation model forward pass
+            punctuation_model: Already loaded model with the PunctuationModel interface, loads the default one if None
+        """
+        if punctuation_model is None:
+            from deepmultilingualpunctuation import PunctuationModel
+            punctuation_model = PunctuationModel()
+        self.punctuation_model = punctuation_model
+        # the underlying transformers pipeline is not safe to call from several threads at once
+        self.punctuation_lock = threading.Lock()
         self.max_gap = max_gap
+        self.batch_size = max(batch_size, 1)
     
-    def prettify(self, tags: List[ModelTag]) -> List[ModelTag]:
+    def prettify(self, tags: List[ModelTag], open_ended: bool = False) -> List[ModelTag]:
         """
         Apply punctuation and capitalization to word-level tags
         
         Args:
             tags: List of word-level ModelTags
-            max_gap: Maximum gap in ms to consider words part of same sentence
+            open_ended: The speech may go on after the last tag, so the last sentence only ends with a delimiter if
+                the punctuation model puts one there
         
         Returns:
             List of ModelTags with corrected text
         """
+        return self.prettify_batch([tags], open_ended=open_ended)[0]
+
+    def prettify_batch(self, tag_lists: List[List[ModelTag]], open_ended: bool = False) -> List[List[ModelTag]]:
+        """
+        Same as prettify for each list of tags, but the sentences of all of them are punctuated together
+
+        Args:
+            tag_lists: List of word-level ModelTag lists, e.g. one per file
+            open_ended: Same as for prettify, applies to each list
+
+        Returns:
+            List of corrected ModelTag lists, in the same order as tag_lists
+        """
+        sentences = [self._split_sentences(tags) for tags in tag_lists]
+        texts = [s for file_sentences in sentences for s in file_sentences]
+        # sentences split off by a pause are finished, only the last one of each list may go on
+        closed = [not open_ended or i + 1 < len(file_sentences)
+                  for file_sentences in sentences for i in range(len(file_sentences))]
+        
+        # Apply corrections to each sentence
+        corrected = iter(self._correct_texts(texts, closed))
+
+        outputs = []
+        for tags, file_sentences in zip(tag_lists, sentences):
+            corrected_text = ' '.join(next(corrected) for _ in file_sentences)
+            corrected_words = corrected_text.split()
+        
+            # Update tags with corrected words
+            output_tags: List[ModelTag] = []
+            for i, tag in enumerate(tags):
+                if i < len(corrected_words):
+                    output_tags.append(ModelTag(
+                        start_time=tag.start_time,
+                        end_time=tag.end_time,
+                        tag=corrected_words[i],
+                    ))
+            outputs.append(output_tags)
+        
+        return outputs
+
+    def _split_sentences(self, tags: List[ModelTag]) -> List[str]:
+        """Group into sentences based on time gaps"""
         if len(tags) == 0:
             return []
         
-        # Group into sentences based on time gaps
         sentences = []
         current_sentence = [tags[0].tag]
         last_start = tags[0].start_time
@@ -37,33 +96,20 @@ class Prettifier:
             last_start = tag.start_time
         
         sentences.append(' '.join(current_sentence))
-        
-        # Apply corrections to each sentence
-        corrected_sentences = [self._correct_text(s) for s in sentences]
-        corrected_text = ' '.join(corrected_sentences)
-        corrected_words = corrected_text.split()
-        
-        # Update tags with corrected words
-        output_tags: List[ModelTag] = []
-        for i, tag in enumerate(tags):
-            if i < len(corrected_words):
-                output_tags.append(ModelTag(
-                    start_time=tag.start_time,
-                    end_time=tag.end_time,
-                    tag=corrected_words[i],
-                ))
-        
-        return output_tags
+        return sentences
     
-    def _correct_text(self, text: str) -> str:
-        """Apply punctuation and capitalization to a single piece of text"""
-        if text == "":
-            return text
-        
-        res = self._capitalize_proper_nouns(text)
-        res = self.punctuation_model.restore_punctuation(res)
-        
-        if not res.endswith("."):
+    def _correct_texts(self, texts: List[str], closed: Optional[List[bool]] = None) -> List[str]:
+        """Apply punctuation and capitalization to several pieces of text, closed ones are made to end with a '.'"""
+        if closed is None:
+            closed = [True] * len(texts)
+        res = [self._capitalize_proper_nouns(text) for text in texts]
+        with self.punctuation_lock:
+            res = self._restore_punctuation_batch(res)
+        return [self._capitalize_sentences(r, close) if text != "" else text
+                for text, r, close in zip(texts, res, closed)]
+
+    def _capitalize_sentences(self, res: str, close: bool = True) -> str:
+        if close and not res.endswith("."):
             res += "."
         
         # Capitalize first letter of sentences
@@ -76,7 +122,76 @@ class Prettifier:
                 capitalized.append(c)
         
         return ''.join(capitalized)
+
+    def _restore_punctuation_batch(self, texts: List[str]) -> List[str]:
+        """
+        Same as PunctuationModel.restore_punctuation for each text, but the chunks of all texts are tokenized
+        together and go through the token classification model in padded batches
+        """
+        model = self.punctuation_model
+
+        # (text index, chunk words, number of trailing words that are labeled by the next chunk instead)
+        chunks: List[Tuple[int, List[str], int]] = []
+        for i, text in enumerate(texts):
+            words = model.preprocess(text)
+            overlap = PUNCTUATION_CHUNK_OVERLAP if len(words) > PUNCTUATION_CHUNK_SIZE else 0
+            batches = list(model.overlap_chunks(words, PUNCTUATION_CHUNK_SIZE, overlap))
+            # if the last batch is smaller than the overlap, the previous one already covers it
+            if len(batches) > 0 and len(batches[-1]) <= overlap:
+                batches.pop()
+            for batch in batches:
+                chunks.append((i, batch, 0 if batch == batches[-1] else overlap))
+
+        results: List[List[Dict[str, Any]]] = []
+        for start in range(0, len(chunks), self.batch_size):
+            batch_texts = [" ".join(words) for _, words, _ in chunks[start:start + self.batch_size]]
+            results.extend(self._classify_tokens(batch_texts))
+
+        tagged_words: List[List[list]] = [[] for _ in texts]
+        for (i, words, overlap), result in zip(chunks, results):
+            char_index = 0
+            result_index = 0
+            score = None
+            for word in words[:len(words)-overlap]:
+                char_index += len(word) + 1
+                # if any subtoken of a word is labeled as sentence end, the whole word is
+                label = "0"
+                while result_index < len(result) and char_index > result[result_index]["end"]:
+                    label = result[result_index]["entity"]
+                    score = result[result_index]["score"]
+                    result_index += 1
+                tagged_words[i].append([word, label, score])
+
+        return [model.prediction_to_text(tagged) for tagged in tagged_words]
+
+    def _classify_tokens(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """Padded equivalent of calling the "ner" pipeline on each text, without entity grouping"""
+        pipe = self.punctuation_model.pipe
+        inputs = pipe.tokenizer(
+            texts,
+            padding=True,
+            return_tensors="pt",
+            return_offsets_mapping=True,
+            return_special_tokens_mask=True,
+        )
+        offsets = inputs.pop("offset_mapping").tolist()
+        special = inputs.pop("special_tokens_mask").tolist()
+        attention = inputs["attention_mask"].tolist()
+        with torch.inference_mode():
+            logits = pipe.model(**inputs.to(pipe.device))[0]
+        scores, label_ids = torch.softmax(logits, dim=-1).max(dim=-1)
+        scores, label_ids = scores.tolist(), label_ids.tolist()
+        id2label = pipe.model.config.id2label
+
+        return [
+            [
+                {"entity": id2label[label_ids[row][k]], "score": scores[row][k], "end": offsets[row][k][1]}
+                for k in range(len(offsets[row]))
+                if attention[row][k] and not special[row][k]
+            ]
+            for row in range(len(texts))
+        ]
     
     def _capitalize_proper_nouns(self, sentence: str) -> str:
         # TODO: add back spacy
-        return sentence
\ No newline at end of file
+        return sentence
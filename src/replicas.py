@@ -0,0 +1,312 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import torch
+import torch.multiprocessing as mp
+from loguru import logger
+
+"""
+Copies of a model running in worker processes, one per device or set of cpu cores.
+
+Every replica is handed the next task as soon as it reports that it is idle, so a replica that got a batch of long files
+never holds up the others and there is nothing to rebalance. Results come back as futures, in whatever order the
+replicas finish, the caller keeps track of the order it needs.
+
+Tasks are handed out by this process, which records the task of each replica before sending it. Each replica sends its
+results back on a pipe of its own, a replica killed in the middle of a message never blocks the others. A replica that
+dies only fails that task, and is started again in its place.
+"""
+
+# how often the result thread checks that the replicas are still alive (in seconds)
+_POLL_INTERVAL = 1.0
+
+
+class ReplicaPool:
+    """
+    Args:
+        devices: One entry per replica, a torch device like "cuda:1", or "cpu:0-15" for a cpu replica pinned to
+            cores 0-15 ("cpu:0,2,4" works as well, plain "cpu" is not pinned)
+        load: Loads the model of a replica given its torch device, called in the replica process
+        run: Runs a task on a loaded model, its return value resolves the future of the task
+        threads: torch intra-op threads of each cpu replica, by default one per pinned core
+
+    load and run are sent to the replica processes, so they have to be module level functions.
+    """
+
+    def __init__(
+        self,
+        devices: List[str],
+        load: Callable[[str], Any],
+        run: Callable[[Any, Any], Any],
+        threads: int = 0,
+    ):
+        if len(devices) == 0:
+            raise ValueError("ReplicaPool needs at least one device")
+        # spawn rather than fork, forked processes cannot use cuda and inherit the parent's torch thread pools
+        self.ctx = mp.get_context("spawn")
+        self.devices = devices
+        self.load = load
+        self.run = run
+        self.threads = threads
+        # one task queue per replica, it only ever holds the task the replica was handed and the stop signal
+        self.inputs: List[mp.Queue] = [self.ctx.Queue() for _ in devices]
+        # the reading end of the result pipe of each replica, read by the result thread only, None once closed
+        self.results: List[Optional[Connection]] = [None] * len(devices)
+
+        # the fields below are guarded by lock
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        # tasks waiting for an idle replica
+        self.backlog: Deque[Tuple[int, Any]] = deque()
+        self.idle: Deque[int] = deque()
+        # the task each busy replica was handed
+        self.assigned: Dict[int, int] = {}
+        self.task_ids = itertools.count()
+        self.error: Optional[Exception] = None
+        self.closed = False
+
+        # replicas being started again after they died, they take tasks once loaded
+        self.restarting: Set[int] = set()
+        # None for a replica that failed to load again after dying
+        self.processes: List[Optional[mp.Process]] = [self._start(index) for index in range(len(devices))]
+        try:
+            self._wait_ready()
+        except Exception:
+            self.close()
+            raise
+        self.idle.extend(range(len(devices)))
+        logger.info(f"Started {len(devices)} model replicas on {', '.join(devices)}")
+
+        self.collector = threading.Thread(target=self._collect, name="replica-results", daemon=True)
+        self.collector.start()
+
+    def __len__(self) -> int:
+        """Number of replicas running or being started again, the ones given up on are not counted"""
+        return sum(process is not None for process in self.processes)
+
+    def submit(self, payload: Any) -> Future:
+        """Hands payload to the next idle replica, the future resolves to run(model, payload)"""
+        future: Future = Future()
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if self.closed:
+                raise RuntimeError("ReplicaPool is closed")
+            task_id = next(self.task_ids)
+            self.pending[task_id] = future
+            self.backlog.append((task_id, payload))
+            if self.idle:
+                self._dispatch(self.idle.popleft())
+        return future
+
+    def close(self) -> None:
+        """Stops the replicas once they finish the task they are running, tasks not started yet fail"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.backlog.clear()
+            processes = [(index, process) for index, process in enumerate(self.processes) if process is not None]
+        for index, _ in processes:
+            self.inputs[index].put(None)
+        for _, process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        # the result thread exits once it read everything the stopped replicas sent
+        if getattr(self, "collector", None) is not None:
+            self.collector.join()
+        else:
+            for index in range(len(self.results)):
+                self._close_results(index)
+        self._fail_pending(RuntimeError("ReplicaPool was closed before the task finished"))
+
+    def _start(self, index: int) -> mp.Process:
+        device, cores = parse_device(self.devices[index])
+        reader, writer = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(
+            target=_replica_main,
+            args=(index, device, cores, self.threads, self.load, self.run, self.inputs[index], writer),
+            name=f"asr-replica-{index}",
+            daemon=True,
+        )
+        process.start()
+        # only the replica holds the writing end, reads fail with EOFError once it exits
+        writer.close()
+        self._close_results(index)
+        self.results[index] = reader
+        return process
+
+    def _close_results(self, index: int) -> None:
+        if self.results[index] is not None:
+            self.results[index].close()
+            self.results[index] = None
+
+    def _receive(self, timeout: float) -> List[Tuple[int, Optional[int], Any, Optional[str]]]:
+        """Messages of the replicas that sent one within timeout, the pipe of a replica that exited is closed"""
+        readers = {reader: index for index, reader in enumerate(self.results) if reader is not None}
+        messages = []
+        for reader in wait(list(readers), timeout=timeout):
+            try:
+                messages.append(reader.recv())
+            except (EOFError, OSError):
+                # the replica exited, maybe in the middle of a message, it is replaced on the next check
+                self._close_results(readers[reader])
+        return messages
+
+    def _dispatch(self, index: int) -> None:
+        """Hands the next task of the backlog to the idle replica index, or marks it idle, called with lock held"""
+        if self.closed or not self.backlog:
+            self.idle.append(index)
+            return
+        task_id, payload = self.backlog.popleft()
+        # recorded before it is sent, so the task is known wherever the replica dies
+        self.assigned[index] = task_id
+        self.inputs[index].put((task_id, payload))
+
+    def _wait_ready(self) -> None:
+        ready: Set[int] = set()
+        while len(ready) < len(self.processes):
+            messages = self._receive(_POLL_INTERVAL)
+            for index, _, _, error in messages:
+                if error is not None:
+                    raise RuntimeError(f"Replica {index} failed to load its model: {error}")
+                ready.add(index)
+            if not messages:
+                self._check_alive()
+
+    def _collect(self) -> None:
+        """Resolves the futures of finished tasks, hands out the next ones and replaces dead replicas"""
+        next_check = time.monotonic() + _POLL_INTERVAL
+        while not (self.closed and all(reader is None for reader in self.results)):
+            # checked on a timer rather than when idle, a busy pool never waits long enough for the pipes to be empty
+            if time.monotonic() >= next_check:
+                self._replace_dead()
+                next_check = time.monotonic() + _POLL_INTERVAL
+            for index, task_id, result, error in self._receive(_POLL_INTERVAL):
+                if task_id is None:
+                    self._restarted(index, error)
+                    continue
+                with self.lock:
+                    future = self.pending.pop(task_id, None)
+                    if self.assigned.get(index) == task_id:
+                        del self.assigned[index]
+                        self._dispatch(index)
+                if future is None:
+                    continue
+                if error is not None:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result(result)
+
+    def _replace_dead(self) -> None:
+        """Fails the task of each replica that died and starts it again"""
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive() or self.closed:
+                continue
+            if index in self.restarting:
+                # died while loading, before it could report an error
+                self._restarted(index, f"exited with code {process.exitcode}")
+                continue
+            error = RuntimeError(f"Replica {index} exited unexpectedly with code {process.exitcode}")
+            with self.lock:
+                # started with the lock held, close either stops the new replica or it is not started
+                if self.closed:
+                    return
+                logger.error(f"{error}, starting it again")
+                if index in self.idle:
+                    self.idle.remove(index)
+                task_id = self.assigned.pop(index, None)
+                future = self.pending.pop(task_id, None) if task_id is not None else None
+                # the old queue may still hold the task the replica died before taking, nothing will read it
+                self.inputs[index].cancel_join_thread()
+                self.inputs[index] = self.ctx.Queue()
+                self.restarting.add(index)
+                self.processes[index] = self._start(index)
+            if future is not None:
+                future.set_exception(error)
+
+    def _restarted(self, index: int, error: Optional[str]) -> None:
+        """Handles the ready message of a replica started again, it is given up on if it cannot load its model"""
+        if index not in self.restarting:
+            return
+        self.restarting.discard(index)
+        if error is None:
+            logger.info(f"Replica {index} is running again")
+            with self.lock:
+                self._dispatch(index)
+            return
+        logger.error(f"Replica {index} failed to load its model again, continuing without it: {error}")
+        self.processes[index].join(timeout=30)
+        self.processes[index] = None
+        if all(process is None for process in self.processes):
+            self._fail_pending(RuntimeError("All model replicas failed"))
+
+    def _check_alive(self) -> None:
+        for index, process in enumerate(self.processes):
+            if not process.is_alive() and not self.closed:
+                raise RuntimeError(f"Replica {index} exited unexpectedly with code {process.exitcode}")
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self.lock:
+            self.error = self.error or error
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.backlog.clear()
+            self.assigned.clear()
+        for future in pending:
+            future.set_exception(error)
+
+
+def parse_device(spec: str) -> Tuple[str, Optional[List[int]]]:
+    """Splits a replica device like "cpu:0-3,8" into the torch device and the cores to pin it to"""
+    if not spec.startswith("cpu:"):
+        return spec, None
+    cores: List[int] = []
+    for part in spec[len("cpu:"):].split(","):
+        first, _, last = part.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return "cpu", cores
+
+
+def _replica_main(
+    index: int,
+    device: str,
+    cores: Optional[List[int]],
+    threads: int,
+    load: Callable[[str], Any],
+    run: Callable[[Any, Any], Any],
+    tasks: "mp.Queue",
+    results: Connection,
+) -> None:
+    """Entry point of a replica process: loads the model, then runs the tasks it is handed until it gets None"""
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    if device == "cpu" and (threads > 0 or cores is not None):
+        torch.set_num_threads(threads if threads > 0 else len(cores))
+
+    try:
+        model = load(device)
+    except Exception as e:
+        results.send((index, None, None, f"{type(e).__name__}: {e}"))
+        return
+    results.send((index, None, None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, payload = task
+        try:
+            result = run(model, payload)
+        except Exception as e:
+            # exceptions are sent as text, not all of them can be pickled
+            results.send((index, task_id, None, f"Replica {index}: {type(e).__name__}: {e}"))
+            continue
+        results.send((index, task_id, result, None))
@@ -0,0 +1,115 @@
+import io
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from dacite import from_dict
+from loguru import logger
+
+from src.asr_producer import ASRProducer, RuntimeConfig, check_runtime_config
+from src.default_loop import MessageWriter
+from src.message_producer import Error, ErrorMessage
+from src.pretty import Prettifier
+from src.replicas import ReplicaPool
+from src.stt import EnglishSTT
+
+"""
+Persistent worker mode: the models are loaded once and every request runs a job on them.
+
+POST /transcribe with {"files": [...], "params": {...}} streams back the same JSONL messages run.py writes to its
+output file, params being the RuntimeConfig fields as passed with --params. GET /health answers once the models are
+loaded.
+"""
+
+class ASRServer(ThreadingHTTPServer):
+    """
+    Args:
+        address: (host, port) to listen on
+        model: Loaded STT model shared by all jobs
+        prettifier: Loaded Prettifier shared by all jobs
+        replicas: Started acoustic model replicas shared by all jobs, if configured
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        model: EnglishSTT,
+        prettifier: Prettifier,
+        replicas: Optional[ReplicaPool] = None,
+    ):
+        super().__init__(address, _JobHandler)
+        self.model = model
+        self.prettifier = prettifier
+        self.replicas = replicas
+        # the models are shared, so jobs run one at a time and later requests wait for their turn
+        self.job_lock = threading.Lock()
+
+    def run_job(self, files: List[str], cfg: RuntimeConfig, writer: MessageWriter) -> None:
+        with self.job_lock:
+            producer = None
+            try:
+                producer = ASRProducer(cfg, model=self.model, prettifier=self.prettifier, replicas=self.replicas)
+                # a job is the only produce() call of its producer, nothing comes after it to finish a sentence
+                for msg in itertools.chain(producer.produce(files), producer.finish()):
+                    writer.write(msg)
+                writer.end_batch()
+            except (BrokenPipeError, ConnectionResetError):
+                logger.warning(f"Client disconnected, dropping the rest of a job of {len(files)} files")
+            except Exception as e:
+                logger.opt(exception=e).error("Job failed")
+                writer.write(ErrorMessage(type="error", data=Error(message=str(e))))
+                writer.end_batch()
+            finally:
+                if producer is not None:
+                    producer.close()
+
+class _JobHandler(BaseHTTPRequestHandler):
+    server: ASRServer
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        self._send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/transcribe":
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            files = body["files"]
+            if not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+                raise ValueError("files must be a list of paths")
+            cfg = from_dict(data=body.get("params") or {}, data_class=RuntimeConfig)
+            # the response is committed to 200 once the job starts, so bad params are rejected here
+            check_runtime_config(cfg)
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        logger.info(f"Received a job of {len(files)} files with {cfg}")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        # the response has no length, it ends when the connection is closed after the job
+        out = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+        try:
+            self.server.run_job(files, cfg, MessageWriter(out))
+        finally:
+            # leaves closing the socket to the handler
+            out.detach()
+
+    def _send_json(self, status: int, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
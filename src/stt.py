@@ -1,86 +1,366 @@
+import contextlib
+import json
 import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+import numpy as np
+import yaml
 import torch
-from typing import List, Tuple
+from types import SimpleNamespace
+from typing import ContextManager, List, Optional, Tuple
 from loguru import logger
 
-import nemo.collections.asr as nemo_asr
-from ctcdecode import CTCBeamDecoder
-
 from .utils import postprocess
+from .audio import SAMPLE_RATE
 from src.tags import ModelTag
 
 TOKEN_OFFSET = 100
 FRAME_SIZE = .04
+FRAME_SAMPLES = int(FRAME_SIZE * SAMPLE_RATE)
 
 class EnglishSTT():
     """Pure STT model - takes tensor, outputs word-level tags"""
     
-    def __init__(self, asr_path: str, lm_path: str):
-        self.device = 'cuda'
-        load_path = asr_path
-        self.model = nemo_asr.models.EncDecCTCModelBPE.restore_from(
-            load_path, map_location=self.device).eval()
-        logger.info(f"Loaded model from {load_path}")
+    def __init__(
+        self,
+        asr_path: str,
+        lm_path: str,
+        chunk_length: float = 0,
+        chunk_overlap: float = 0,
+        batch_size: int = 1,
+        device: str = 'auto',
+        cpu_threads: int = 0,
+        quantize: bool = False,
+        cache_extracted: bool = False,
+        beam_width: int = 32,
+        alpha: float = 0.25,
+        beta: float = 0.5,
+        precision: str = 'fp32',
+        model: Optional[torch.nn.Module] = None,
+        decode_only: bool = False,
+    ):
+        """
+        Args:
+            asr_path: path to the .nemo acoustic model, or to a .ts TorchScript export of it written by export()
+            lm_path: path to the KenLM model used by the beam search
+            chunk_length: audio longer than this (in seconds) is run through the acoustic model in overlapping
+                windows of this length, 0 to always use a single forward pass
+            chunk_overlap: audio shared by consecutive windows (in seconds)
+            batch_size: maximum number of files or windows per acoustic model forward pass
+            device: 'cuda', 'cuda:<index>', 'cpu' or 'auto' to use cuda when it is available
+            cpu_threads: number of intra-op threads torch uses on cpu, 0 to keep the torch default
+            quantize: run the linear layers of the acoustic model with dynamic int8 quantization (cpu only)
+            cache_extracted: unpack the .nemo archive next to asr_path once and restore from the unpacked copy on
+                later starts, instead of unpacking it to a temporary directory every time
+            beam_width: number of beams kept by the beam search
+            alpha: weight of the language model in the beam search
+            beta: bonus per word in the beam search, counteracting the language model's bias to short transcripts
+            precision: 'fp32', or 'fp16' / 'bf16' to run the acoustic model under autocast, falls back to fp32 where
+                the device does not support it (bf16 only on cpu)
+            model: already loaded acoustic model with the EncDecCTCModelBPE interface, asr_path is ignored if set
+            decode_only: only read the vocabulary from asr_path, not the weights, for a process that decodes probs
+                computed elsewhere, e.g. by replicas. compute_probs then raises
+        """
+        self.device = _select_device(device)
+        if self.device == 'cpu' and cpu_threads > 0:
+            torch.set_num_threads(cpu_threads)
+        self.batch_size = max(batch_size, 1)
+        # window sizes are rounded to whole frames so that window boundaries line up with the model output
+        self.chunk_samples = round(chunk_length / FRAME_SIZE) * FRAME_SAMPLES
+        self.overlap_samples = round(chunk_overlap / FRAME_SIZE) * FRAME_SAMPLES
+        if self.chunk_samples > 0 and self.overlap_samples >= self.chunk_samples:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}s) must be smaller than chunk_length ({chunk_length}s)")
+        if model is None and decode_only:
+            model = _VocabularyModel(_read_vocabulary(asr_path))
+        elif model is None and asr_path.endswith('.ts'):
+            model = _load_exported_model(asr_path, self.device)
+        elif model is None:
+            model = _restore_nemo_model(asr_path, self.device, cache_extracted)
+        self.model = model.to(self.device).eval()
+        # exported models output probs, the .nemo model log probs
+        self.outputs_probs = isinstance(model, ExportedModel)
+        self.precision = _select_precision(self.device, precision)
+        # nothing to quantize without the weights
+        quantize = quantize and not decode_only
+        if quantize and self.outputs_probs:
+            logger.warning("Exported models cannot be quantized when loading, export a quantized model instead")
+        elif quantize:
+            if self.device == 'cpu':
+                torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+                logger.info("Quantized linear layers to int8")
+            else:
+                logger.warning(f"Dynamic quantization is only supported on cpu, ignoring it on {self.device}")
         self.ids_to_text_func = self.model.tokenizer.ids_to_text
         self.ids_to_tokens_func = self.model.tokenizer.ids_to_tokens
         vocab = self.model.decoder.vocabulary + ["_"]
+        # whether each token id starts a new word, the blank (last id) never does
+        word_start = [tok.startswith('▁') for tok in self.ids_to_tokens_func(list(range(len(vocab) - 1)))]
+        self.word_start = np.array(word_start + [False], dtype=bool)
+        self.blank_id = len(vocab) - 1
         lm = lm_path
 
+        start = time.perf_counter()
+        # deferred so that importing this module does not load the native decoder
+        from ctcdecode import CTCBeamDecoder
         self.decoder = CTCBeamDecoder(
             [chr(idx + TOKEN_OFFSET) for idx in range(len(vocab))],
             model_path=lm,
-            beam_width=32,
-            alpha=0.25,
-            beta=0.5,
-            blank_id=128,
+            beam_width=beam_width,
+            alpha=alpha,
+            beta=beta,
+            blank_id=self.blank_id,
             num_processes=max(os.cpu_count(), 1),
         )
-        logger.debug(f"loading weights from {lm_path} ...")
+        self.beam_params = (beam_width, alpha, beta)
+        logger.info(f"Built beam search decoder with {lm_path} in {time.perf_counter() - start:.1f}s")
+
+    def set_beam_params(self, beam_width: int, alpha: float, beta: float) -> None:
+        """Changes the beam search parameters in place, without reloading the language model"""
+        if (beam_width, alpha, beta) == self.beam_params:
+            return
+        # ctcdecode has no public setter for the beam width, only reset_params for alpha and beta. decode() reads
+        # _beam_width on every call, and setting it avoids building a new CTCBeamDecoder, which reloads the LM
+        self.decoder._beam_width = beam_width
+        self.decoder.reset_params(alpha, beta)
+        self.beam_params = (beam_width, alpha, beta)
+        logger.info(f"Beam search parameters set to beam_width={beam_width}, alpha={alpha}, beta={beta}")
 
     def _compute_probs(self, audio: torch.Tensor) -> torch.Tensor:
-        audio = audio.to(self.device)
-        audio_length = torch.Tensor([audio.size(1)]).to(self.device)
-        with torch.no_grad():
-            logits, _, _ = self.model(
-                input_signal=audio, input_signal_length=audio_length)
-        probs = torch.nn.functional.softmax(logits, dim=-1)
+        return self.compute_probs_batch([audio])[0]
+
+    def compute_probs_batch(self, audios: List[torch.Tensor]) -> List[torch.Tensor]:
+        """
+        Compute probs for several audio tensors, short ones go through the acoustic model together in padded batches
+
+        Args:
+            audios: List of torch.Tensor of shape (1, num_samples)
+
+        Returns:
+            List of probs of shape (1, num_frames, vocab_size), in the same order as audios
+        """
+        probs: List[Optional[torch.Tensor]] = [None] * len(audios)
+        short = []
+        for i, audio in enumerate(audios):
+            if self.chunk_samples == 0 or audio.size(1) <= self.chunk_samples:
+                short.append(i)
+            else:
+                probs[i] = self._compute_probs_chunked(audio)
+
+        for i in range(0, len(short), self.batch_size):
+            idxs = short[i:i + self.batch_size]
+            for idx, item_probs in zip(idxs, self._forward([audios[j] for j in idxs])):
+                probs[idx] = item_probs
+
         return probs
 
-    def _beamsearch(self, logits: torch.Tensor) -> Tuple[str, float, List[int], List[str]]:
-        logits = logits.to(self.device)
-        beams, scores, timesteps, out_lens = self.decoder.decode(logits)
-        best_candidate = beams[0][0]
-        seq_length = out_lens[0][0].item()
-        score = scores[0][0].item()
-        timesteps = timesteps[0][0]
-        timesteps = timesteps[:seq_length] * FRAME_SIZE
-        timesteps = timesteps.tolist()
-        best_candidate = best_candidate[:seq_length].tolist()
-        proxy_chars_seq = [self.decoder._labels[idx] for idx in best_candidate]
-        converted_best_candidate = [
-            ord(c)-TOKEN_OFFSET for c in proxy_chars_seq]
-        tokens = self.ids_to_tokens_func(converted_best_candidate)
-        pred_text = self.ids_to_text_func(converted_best_candidate)
-
-        return pred_text, score, timesteps, tokens
-
-    def _get_word_level_timestamps(self, timestamps: list, tokens: list, frame_size: float) -> list:
-        timestamps = timestamps[:]
-        for i in range(1, len(timestamps)):
-            timestamps[i] = max(timestamps[i], timestamps[i-1])
-        logger.debug(f"get_word_level_timestamps")
-        word_timestamps = []
-        current_start = None
-        current_end = None
-        for ts, tok in zip(timestamps, tokens):
-            if tok.startswith('▁'):
-                if current_start is not None:
-                    word_timestamps.append((current_start, current_end + frame_size))
-                current_start = ts
-            current_end = ts
-        if current_start is not None:
-            word_timestamps.append((current_start, current_end + frame_size))
-        return word_timestamps
+    def compute_probs_regions_batch(
+        self,
+        audios: List[torch.Tensor],
+        regions: List[List[Tuple[int, int]]],
+    ) -> List[torch.Tensor]:
+        """
+        Same as compute_probs_batch, but only the given parts of each audio go through the acoustic model
+
+        Frames outside of the regions are filled with certain blanks, so the output still covers the whole audio and
+        timestamps decoded from it need no mapping. An audio whose only region is all of it is computed in one piece,
+        exactly like compute_probs_batch does.
+
+        Args:
+            audios: List of torch.Tensor of shape (1, num_samples)
+            regions: Per audio, sorted non-overlapping (start, end) sample ranges starting on frame boundaries
+
+        Returns:
+            List of probs of shape (1, num_frames, vocab_size), in the same order as audios
+        """
+        segments = [audio[:, start:end] for audio, item_regions in zip(audios, regions) for start, end in item_regions]
+        segment_probs = iter(self.compute_probs_batch(segments))
+
+        probs = []
+        for audio, item_regions in zip(audios, regions):
+            if item_regions == [(0, audio.size(1))]:
+                probs.append(next(segment_probs))
+                continue
+            num_frames = round(audio.size(1) / FRAME_SAMPLES)
+            item_probs = torch.zeros(1, num_frames, len(self.word_start), device=self.device)
+            item_probs[:, :, self.blank_id] = 1.0
+            for start, _ in item_regions:
+                region_probs = next(segment_probs)
+                first = start // FRAME_SAMPLES
+                # the model may emit a frame more or less than the region is long
+                n = min(region_probs.size(1), num_frames - first)
+                item_probs[:, first:first + n] = region_probs[:, :n]
+            probs.append(item_probs)
+        return probs
+
+    def _compute_probs_chunked(self, audio: torch.Tensor) -> torch.Tensor:
+        """
+        Run the acoustic model over overlapping windows so that memory is bounded by the window length
+        
+        Half of the overlap is trimmed from each side of every seam, so each kept frame was computed with at least
+        chunk_overlap/2 seconds of context, and the kept frames are concatenated at their original frame offsets.
+        """
+        num_samples = audio.size(1)
+        step = self.chunk_samples - self.overlap_samples
+        step_frames = step // FRAME_SAMPLES
+        trim = self.overlap_samples // FRAME_SAMPLES // 2
+
+        windows = []
+        start = 0
+        while True:
+            end = min(start + self.chunk_samples, num_samples)
+            windows.append((start, end))
+            if end == num_samples:
+                break
+            start += step
+
+        pieces = []
+        for i in range(0, len(windows), self.batch_size):
+            batch = windows[i:i + self.batch_size]
+            outputs = self._forward([audio[:, start:end] for start, end in batch])
+            for (start, end), probs in zip(batch, outputs):
+                first = 0 if start == 0 else trim
+                last = probs.size(1) if end == num_samples else step_frames + trim
+                pieces.append(probs[:, first:last, :])
+
+        return torch.cat(pieces, dim=1)
+
+    def _forward(self, audios: List[torch.Tensor]) -> List[torch.Tensor]:
+        """Single forward pass over a padded batch, the output is unpacked using the encoder output lengths"""
+        lengths = torch.tensor([audio.size(1) for audio in audios], dtype=torch.long, device=self.device)
+        batch = torch.nn.utils.rnn.pad_sequence([audio[0] for audio in audios], batch_first=True)
+        batch = batch.to(self.device)
+        with torch.inference_mode(), self._autocast():
+            outputs, encoded_len, _ = self.model(
+                input_signal=batch, input_signal_length=lengths)
+        # the rest of the pipeline works on fp32 probs whatever the model ran in
+        if self.outputs_probs:
+            probs = outputs.float()
+        else:
+            probs = torch.nn.functional.softmax(outputs.float(), dim=-1)
+        return [probs[i:i + 1, :int(encoded_len[i])] for i in range(len(audios))]
+
+    def _autocast(self) -> ContextManager:
+        if self.precision == 'fp32':
+            return contextlib.nullcontext()
+        dtype = torch.float16 if self.precision == 'fp16' else torch.bfloat16
+        if hasattr(torch, 'autocast'):
+            return torch.autocast(self.device.split(':')[0], dtype=dtype)
+        # torch < 1.10 only autocasts on cuda, to fp16
+        return torch.cuda.amp.autocast()
+
+    def export(self, path: str, example_seconds: float = 8.0) -> None:
+        """
+        Trace the acoustic model into a TorchScript file that can be loaded instead of the .nemo checkpoint
+
+        The traced graph ends in the conversion of the log probs to probs, so that runs as part of the graph instead of
+        as a separate softmax. The trace is checked against the model on a batch of other lengths, so shapes that got
+        baked into the graph fail here rather than at inference. A quantized model is exported quantized.
+
+        Args:
+            path: Where to write the graph, should end in .ts
+            example_seconds: Length of the audio the model is traced with
+        """
+        if self.outputs_probs:
+            raise ValueError("The model is already exported")
+        graph = _ProbsGraph(self.model).eval()
+        generator = torch.Generator().manual_seed(0)
+
+        def example(seconds: List[float]) -> Tuple[torch.Tensor, torch.Tensor]:
+            audios = [0.1 * torch.randn(round(s * SAMPLE_RATE), generator=generator) for s in seconds]
+            lengths = torch.tensor([audio.size(0) for audio in audios], dtype=torch.long, device=self.device)
+            return torch.nn.utils.rnn.pad_sequence(audios, batch_first=True).to(self.device), lengths
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            traced = torch.jit.trace(graph, example([example_seconds, example_seconds / 2]), check_trace=False)
+            check = example([example_seconds * 1.7, example_seconds * 0.3, example_seconds])
+            expected_probs, expected_len = graph(*check)
+            probs, encoded_len = traced(*check)
+        if not torch.equal(encoded_len, expected_len) or not torch.allclose(probs, expected_probs, atol=1e-4):
+            raise RuntimeError("The traced model does not match the original on other input lengths")
+
+        vocabulary = list(self.model.decoder.vocabulary)
+        torch.jit.save(traced, path, _extra_files={"vocabulary.json": json.dumps(vocabulary)})
+        logger.info(f"Exported acoustic model to {path} in {time.perf_counter() - start:.1f}s")
+
+    def _beamsearch(self, logits: torch.Tensor) -> Tuple[str, float, np.ndarray, np.ndarray]:
+        return self._beamsearch_batch([logits])[0]
+
+    def _beamsearch_batch(self, logits: List[torch.Tensor]) -> List[Tuple[str, float, np.ndarray, np.ndarray]]:
+        """
+        Beam search several probs matrices with one decoder call, which spreads them over its worker processes
+
+        Returns:
+            List of (text, score, timesteps in ms, token ids) of the best beam of each item, timesteps and token ids
+            being arrays with one entry per emitted token
+        """
+        if len(logits) == 0:
+            return []
+        seq_lens = torch.IntTensor([item.size(1) for item in logits])
+        batch = torch.nn.utils.rnn.pad_sequence([item[0] for item in logits], batch_first=True)
+        batch = batch.to(self.device)
+        beams, scores, timesteps, out_lens = self.decoder.decode(batch, seq_lens)
+
+        results = []
+        for i in range(len(logits)):
+            seq_length = out_lens[i][0].item()
+            score = scores[i][0].item()
+            # decoder labels are chr(id + TOKEN_OFFSET), so the beam already holds the tokenizer ids
+            token_ids = beams[i][0][:seq_length].numpy()
+            item_timesteps = _frames_to_ms(timesteps[i][0][:seq_length].numpy())
+            pred_text = self.ids_to_text_func(token_ids.tolist())
+            results.append((pred_text, score, item_timesteps, token_ids))
+
+        return results
+
+    def _greedy_batch(self, logits: List[torch.Tensor]) -> List[Tuple[str, float, np.ndarray, np.ndarray]]:
+        """
+        Best path decoding without a language model, same output format as _beamsearch_batch
+
+        Each frame's most likely token is taken, repeats are collapsed and blanks dropped, so a token is timed at the
+        first frame of its run like in the beam search output. The score is the log probability of the path.
+        """
+        results = []
+        for item in logits:
+            best_probs, best = item[0].max(dim=-1)
+            # a token is emitted where the best path changes to something other than blank
+            changed = torch.ones_like(best, dtype=torch.bool)
+            changed[1:] = best[1:] != best[:-1]
+            frames = torch.nonzero(changed & (best != self.blank_id)).squeeze(1)
+            token_ids = best[frames].cpu().numpy()
+            score = best_probs.log().sum().item()
+            pred_text = self.ids_to_text_func(token_ids.tolist())
+            results.append((pred_text, score, _frames_to_ms(frames.cpu().numpy()), token_ids))
+        return results
+
+    def _get_word_level_timestamps(
+        self,
+        timestamps: np.ndarray,
+        token_ids: np.ndarray,
+        frame_size: float,
+    ) -> List[Tuple[float, float]]:
+        """
+        Args:
+            timestamps: Emission time of each token in ms
+            token_ids: Tokenizer id of each token
+            frame_size: Frame length in ms, added to the emission time of the last token of a word
+
+        Returns:
+            (start, end) in ms of each word, tokens before the first word start are dropped
+        """
+        if len(timestamps) == 0:
+            return []
+        timestamps = np.maximum.accumulate(timestamps)
+        starts = np.flatnonzero(self.word_start[token_ids])
+        if len(starts) == 0:
+            return []
+        # a word runs up to the token before the next word start, the last one up to the last token
+        ends = np.append(starts[1:], len(timestamps)) - 1
+        return list(zip(timestamps[starts].tolist(), (timestamps[ends] + frame_size).tolist()))
 
     def tag(self, audio_tensor: torch.Tensor) -> List[ModelTag]:
         """
@@ -92,11 +372,62 @@ class EnglishSTT():
         Returns:
             List of ModelTag with word-level timestamps
         """
-        probs = self._compute_probs(audio_tensor)
-        prediction, _, timesteps, tokens = self._beamsearch(probs)
-        timesteps_in_milliseconds = [t*1000 for t in timesteps]
-        word_level_timestamps = self._get_word_level_timestamps(
-            timesteps_in_milliseconds, tokens, FRAME_SIZE*1000)
+        tags, _ = self.transcribe(audio_tensor)
+        return tags
+
+    def transcribe(self, audio_tensor: torch.Tensor) -> Tuple[List[ModelTag], torch.Tensor]:
+        """
+        Same as tag, but also returns the acoustic model output so that callers can re-decode parts of it
+
+        Args:
+            audio_tensor: torch.Tensor of shape (1, num_samples)
+
+        Returns:
+            Tuple of (word-level tags, probs of shape (1, num_frames, vocab_size))
+        """
+        return self.transcribe_batch([audio_tensor])[0]
+
+    def transcribe_batch(self, audio_tensors: List[torch.Tensor]) -> List[Tuple[List[ModelTag], torch.Tensor]]:
+        """
+        Batched version of transcribe, the files share acoustic model forward passes and a single beam search call
+
+        Args:
+            audio_tensors: List of torch.Tensor of shape (1, num_samples)
+
+        Returns:
+            List of (word-level tags, probs) tuples, in the same order as audio_tensors
+        """
+        probs = self.compute_probs_batch(audio_tensors)
+        return list(zip(self.tag_probs_batch(probs), probs))
+
+    def tag_probs(self, probs: torch.Tensor, decoder: str = 'beam') -> List[ModelTag]:
+        """
+        Decode acoustic model output into word-level tags
+
+        Args:
+            probs: torch.Tensor of shape (1, num_frames, vocab_size), frame i starts at i*FRAME_SIZE seconds
+            decoder: 'beam' for the beam search with the language model, 'greedy' for best path decoding
+
+        Returns:
+            List of ModelTag with word-level timestamps
+        """
+        return self.tag_probs_batch([probs], decoder=decoder)[0]
+
+    def tag_probs_batch(self, probs: List[torch.Tensor], decoder: str = 'beam') -> List[List[ModelTag]]:
+        """Batched version of tag_probs"""
+        if decoder == 'beam':
+            decoded = self._beamsearch_batch(probs)
+        elif decoder == 'greedy':
+            decoded = self._greedy_batch(probs)
+        else:
+            raise ValueError(f"Unsupported decoder: {decoder}")
+        return [
+            self._to_tags(prediction, timesteps, token_ids)
+            for prediction, _, timesteps, token_ids in decoded
+        ]
+
+    def _to_tags(self, prediction: str, timesteps: np.ndarray, token_ids: np.ndarray) -> List[ModelTag]:
+        word_level_timestamps = self._get_word_level_timestamps(timesteps, token_ids, FRAME_SIZE*1000)
         prediction, word_level_timestamps = postprocess(prediction, word_level_timestamps)
         
         tags = []
@@ -111,4 +442,180 @@ class EnglishSTT():
         
         # return sorted by start_time
         tags.sort(key=lambda t: t.start_time)
-        return tags
\ No newline at end of file
+        return tags
+
+
+def _frames_to_ms(frames: np.ndarray) -> np.ndarray:
+    # scaled in float32 and only then widened, which is what the original torch tensor math did
+    return (frames.astype(np.float32) * np.float32(FRAME_SIZE)).astype(np.float64) * 1000
+
+
+def _select_device(device: str) -> str:
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    # cuda:N picks one of several gpus, e.g. for a replica
+    if device != 'cpu' and device.split(':')[0] != 'cuda':
+        raise ValueError(f"Unsupported device: {device}")
+    return device
+
+
+def _select_precision(device: str, precision: str) -> str:
+    if precision not in ('fp32', 'fp16', 'bf16'):
+        raise ValueError(f"Unsupported precision: {precision}")
+    if precision == 'fp32':
+        return precision
+    if device == 'cpu':
+        supported = precision == 'bf16' and hasattr(torch, 'autocast')
+    else:
+        supported = precision == 'fp16' or (hasattr(torch, 'autocast') and torch.cuda.is_bf16_supported())
+    if not supported:
+        logger.warning(f"{precision} autocast is not supported on {device} with torch {torch.__version__}, using fp32")
+        return 'fp32'
+    return precision
+
+
+class _ProbsGraph(torch.nn.Module):
+    """What EnglishSTT.export traces: the acoustic model followed by the conversion of its output to probs"""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(
+        self,
+        input_signal: torch.Tensor,
+        input_signal_length: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        log_probs, encoded_len, _ = self.model(input_signal=input_signal, input_signal_length=input_signal_length)
+        # the model already normalizes, so exp gives the softmax of its output without another reduction
+        return log_probs.exp(), encoded_len
+
+
+class _VocabularyTokenizer:
+    """Stands in for the sentencepiece tokenizer of the .nemo model, its pieces mark word starts with '▁'"""
+
+    def __init__(self, vocabulary: List[str]):
+        self.vocabulary = vocabulary
+
+    def ids_to_tokens(self, ids: List[int]) -> List[str]:
+        return [self.vocabulary[i] for i in ids]
+
+    def ids_to_text(self, ids: List[int]) -> str:
+        return ''.join(self.ids_to_tokens(ids)).replace('▁', ' ').strip()
+
+
+class ExportedModel(torch.nn.Module):
+    """
+    TorchScript graph written by EnglishSTT.export, with the parts of the EncDecCTCModelBPE interface EnglishSTT uses.
+    It outputs probs rather than log probs.
+    """
+
+    def __init__(self, graph: torch.jit.ScriptModule, vocabulary: List[str]):
+        super().__init__()
+        self.graph = graph
+        self.tokenizer = _VocabularyTokenizer(vocabulary)
+        self.decoder = SimpleNamespace(vocabulary=vocabulary)
+
+    def forward(self, input_signal: torch.Tensor, input_signal_length: torch.Tensor):
+        probs, encoded_len = self.graph(input_signal, input_signal_length)
+        return probs, encoded_len, None
+
+
+class _VocabularyModel(torch.nn.Module):
+    """The tokenizer and vocabulary of an acoustic model without its weights, see EnglishSTT's decode_only"""
+
+    def __init__(self, vocabulary: List[str]):
+        super().__init__()
+        self.tokenizer = _VocabularyTokenizer(vocabulary)
+        self.decoder = SimpleNamespace(vocabulary=vocabulary)
+
+    def forward(self, input_signal: torch.Tensor, input_signal_length: torch.Tensor):
+        raise RuntimeError("The acoustic model was not loaded, this EnglishSTT was built with decode_only")
+
+
+def _read_vocabulary(asr_path: str) -> List[str]:
+    """Reads the token vocabulary of a .nemo archive or an exported .ts model without loading the weights"""
+    start = time.perf_counter()
+    if asr_path.endswith('.ts'):
+        # TorchScript files are zip archives, export() stores the vocabulary as an extra file
+        with zipfile.ZipFile(asr_path) as archive:
+            name = next(n for n in archive.namelist() if n.endswith('/extra/vocabulary.json'))
+            vocabulary = json.loads(archive.read(name))
+    else:
+        with tarfile.open(asr_path, 'r:*') as tar:
+            # stops at the config rather than listing the whole archive
+            member = next(m for m in tar if os.path.basename(m.name) == 'model_config.yaml')
+            vocabulary = list(yaml.safe_load(tar.extractfile(member))['decoder']['vocabulary'])
+    logger.info(f"Read the vocabulary of {asr_path} in {time.perf_counter() - start:.1f}s")
+    return vocabulary
+
+
+def _load_exported_model(path: str, device: str) -> ExportedModel:
+    start = time.perf_counter()
+    extra_files = {"vocabulary.json": ""}
+    graph = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    model = ExportedModel(graph, json.loads(extra_files["vocabulary.json"]))
+    logger.info(f"Loaded exported model from {path} on {device} in {time.perf_counter() - start:.1f}s")
+    return model
+
+
+def _restore_nemo_model(asr_path: str, device: str, cache_extracted: bool) -> torch.nn.Module:
+    # deferred so that callers passing their own model don't need nemo
+    start = time.perf_counter()
+    import nemo.collections.asr as nemo_asr
+    from nemo.core.connectors.save_restore_connector import SaveRestoreConnector
+    logger.info(f"Imported nemo in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    connector = SaveRestoreConnector()
+    if cache_extracted:
+        connector.model_extracted_dir = _extract_nemo_archive(asr_path)
+    model = nemo_asr.models.EncDecCTCModelBPE.restore_from(
+        asr_path, map_location=device, save_restore_connector=connector)
+    logger.info(f"Loaded model from {asr_path} on {device} in {time.perf_counter() - start:.1f}s")
+    return model
+
+
+def _extract_nemo_archive(asr_path: str) -> Optional[str]:
+    """
+    Unpacks a .nemo archive into <asr_path>.extracted unless an up to date copy is already there
+
+    Returns:
+        The directory, or None if it could not be written, e.g. because the models are mounted read-only
+    """
+    target = asr_path + ".extracted"
+    st = os.stat(asr_path)
+    # the copy is tied to the archive it came from, so replacing the model re-extracts it
+    source = f"{st.st_size}:{st.st_mtime_ns}"
+    if _read_extracted_source(target) == source:
+        return target
+
+    start = time.perf_counter()
+    tmp = None
+    try:
+        tmp = tempfile.mkdtemp(prefix=".extracting-", dir=os.path.dirname(os.path.abspath(asr_path)))
+        with tarfile.open(asr_path, 'r:*') as tar:
+            tar.extractall(tmp)
+        with open(os.path.join(tmp, ".source"), 'w') as f:
+            f.write(source)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(tmp, target)
+    except OSError as e:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+        # another process may have extracted it at the same time
+        if _read_extracted_source(target) == source:
+            return target
+        logger.warning(f"Could not cache the extracted model next to {asr_path}, extracting it on every start: {e}")
+        return None
+    logger.info(f"Extracted {asr_path} to {target} in {time.perf_counter() - start:.1f}s")
+    return target
+
+
+def _read_extracted_source(extracted_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(extracted_dir, ".source")) as f:
+            return f.read()
+    except OSError:
+        return None
@@ -1,8 +1,8 @@
 
-from num2words import num2words
 from word2number import w2n
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Union
 from copy import deepcopy
+from functools import lru_cache
 from src.tags import ModelTag
 
 def combine_tags(tags: List[ModelTag]) -> ModelTag:
@@ -25,6 +25,47 @@ def combine_tags(tags: List[ModelTag]) -> ModelTag:
     )
 
 
+def merge_to_sentences(tags: List[ModelTag]) -> List[ModelTag]:
+    """
+    Merge punctuated word-level ModelTags into one ModelTag per sentence
+    
+    Args:
+        tags: List of word-level ModelTags, sentences end with '.', '?' or '!'
+        
+    Returns:
+        List of sentence-level ModelTags, trailing words without a delimiter form the last sentence
+    """
+    if len(tags) == 0:
+        return []
+
+    sentence_delimiters = {'.', '?', '!'}
+    sentences = []
+    current_words = []
+    current_start = tags[0].start_time
+
+    for i, tag in enumerate(tags):
+        current_words.append(tag.tag)
+
+        if any(tag.tag.endswith(delim) for delim in sentence_delimiters):
+            sentences.append(ModelTag(
+                start_time=current_start,
+                end_time=tag.end_time,
+                tag=' '.join(current_words),
+            ))
+            current_words = []
+            if i + 1 < len(tags):
+                current_start = tags[i + 1].start_time
+
+    if current_words:
+        sentences.append(ModelTag(
+            start_time=current_start,
+            end_time=tags[-1].end_time,
+            tag=' '.join(current_words),
+        ))
+
+    return sentences
+
+
 def nested_update(original: dict, updates: dict) -> dict:
     original = deepcopy(original)
     def helper(original, updates):
@@ -37,23 +78,35 @@ def nested_update(original: dict, updates: dict) -> dict:
     return original
 
 #check if w represents a number e.g "five"
+#transcripts repeat the same words a lot, so the result is cached per token
+@lru_cache(maxsize=4096)
 def _is_numeric_word(w: str) -> bool:
-    try:
-        w2n.word_to_num(w)
-    except Exception:
-        return False
-    return True
+    return _word_to_num(w) is not None
 
-#check if p represents multiword numberical expression such as "one thousand nine hundred and fifty one"
-def _is_numeric_phrase(p: list) -> bool:
+def _word_to_num(p: str) -> Optional[Union[int, float]]:
     try:
-        for item in p:
-            if not _is_numeric_word(item) and not item == "and":
-                return False
-        w2n.word_to_num(' '.join(p))
+        return w2n.word_to_num(p)
     except Exception:
-        return False
-    return True
+        return None
+
+#values of the numeric phrases starting at transcript[idx], e.g. "one thousand nine hundred and fifty one"
+#values[k] is the number that transcript[idx:idx+k+1] represents. The phrase grows one word at a time and stops at
+#the first word that isn't numeric or "and", or at the first prefix that doesn't parse as a number.
+#Every prefix is parsed again from scratch, so this is quadratic in the length of the phrase. word_to_num keeps
+#accepting runs like "five five five", only the number words spoken in a row bound it, and those runs are short.
+def _numeric_phrase_values(transcript: list, idx: int) -> list:
+    values = []
+    phrase = ""
+    for end in range(idx, len(transcript)):
+        item = transcript[end]
+        if not item == "and" and not _is_numeric_word(item):
+            break
+        phrase = item if phrase == "" else phrase + ' ' + item
+        value = _word_to_num(phrase)
+        if value is None:
+            break
+        values.append(value)
+    return values
 
 #postprocess stt output... will REMOVE this function when the model is retrained with more robust preprocessing
 #Fixing two issues: 
@@ -71,12 +124,11 @@ def postprocess(transcript: str, timesteps: list) -> Tuple[str, list]:
     idx = 0
     while idx < len(transcript):
         if _is_numeric_word(transcript[idx]):
-            while idx+seek <= len(transcript) and _is_numeric_phrase(transcript[idx:idx+seek]):
-                seek = seek+1
-            seek -= 1
+            values = _numeric_phrase_values(transcript, idx)
+            seek = len(values)
             while seek > 2 and transcript[idx+seek-1] == "and": #"and" can appear in a numeric phrase, but shouldn't appear at the end.
                 seek -= 1
-            as_number = w2n.word_to_num(' '.join(transcript[idx:idx+seek]))
+            as_number = values[seek-1]
             if seek > min_date_phrase_length and min_year < as_number < max_year: #then we've probably found a year. 
                 transcript[idx] = as_number
                 del transcript[idx+1:idx+seek]
@@ -89,6 +141,8 @@ def postprocess(transcript: str, timesteps: list) -> Tuple[str, list]:
     idx = 0
     while idx < len(transcript)-1:
         if _is_numeric_word(transcript[idx]) and transcript[idx+1] in ordinal_suffixes:
+            # deferred, num2words imports a module for every language it supports and ordinals are rare
+            from num2words import num2words
             transcript[idx] = num2words(w2n.word_to_num(transcript[idx]), to="ordinal")
             transcript.pop(idx+1)
             timesteps.pop(idx+1)
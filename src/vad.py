@@ -0,0 +1,58 @@
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from src.stt import FRAME_SAMPLES, FRAME_SIZE
+
+
+def speech_regions(
+    audio: torch.Tensor,
+    threshold_db: float = -50.0,
+    relative_db: float = 40.0,
+    min_silence: float = 1.0,
+    padding: float = 0.3,
+) -> List[Tuple[int, int]]:
+    """
+    Find the parts of the audio loud enough to contain speech, from the energy of each model frame
+
+    A frame counts as speech if it is above threshold_db and less than relative_db below the 95th percentile frame of
+    the file, so quiet recordings are not cut away wholesale. Pauses shorter than min_silence are kept.
+
+    Args:
+        audio: torch.Tensor of shape (1, num_samples)
+        threshold_db: Absolute energy floor in dB relative to full scale
+        relative_db: How far below the loud parts of the file speech may be
+        min_silence: Shortest silence in seconds that is skipped
+        padding: Seconds of context kept on each side of a speech region
+
+    Returns:
+        Sorted, non-overlapping (start, end) sample ranges, starting on frame boundaries
+    """
+    num_samples = audio.size(1)
+    num_frames = num_samples // FRAME_SAMPLES
+    if num_frames == 0:
+        return [(0, num_samples)] if num_samples > 0 else []
+
+    frames = audio[0, :num_frames * FRAME_SAMPLES].reshape(num_frames, FRAME_SAMPLES).float()
+    energy_db = (10 * torch.log10(frames.pow(2).mean(dim=1) + 1e-10)).cpu().numpy()
+    threshold = max(threshold_db, float(np.quantile(energy_db, 0.95)) - relative_db)
+    speech = np.flatnonzero(energy_db > threshold)
+    if len(speech) == 0:
+        return []
+
+    # runs of speech frames, padded, then merged across gaps shorter than min_silence
+    pad = round(padding / FRAME_SIZE)
+    min_gap = round(min_silence / FRAME_SIZE)
+    breaks = np.flatnonzero(np.diff(speech) > 1)
+    starts = np.maximum(np.concatenate([speech[:1], speech[breaks + 1]]) - pad, 0)
+    ends = np.minimum(np.concatenate([speech[breaks], speech[-1:]]) + 1 + pad, num_frames)
+    keep = np.concatenate([[True], starts[1:] - ends[:-1] >= min_gap])
+    starts = starts[keep]
+    ends = np.concatenate([ends[np.flatnonzero(keep)[1:] - 1], ends[-1:]])
+
+    regions = [(int(s) * FRAME_SAMPLES, int(e) * FRAME_SAMPLES) for s, e in zip(starts, ends)]
+    # the samples after the last whole frame belong to a region reaching the end
+    if ends[-1] == num_frames:
+        regions[-1] = (regions[-1][0], num_samples)
+    return regions
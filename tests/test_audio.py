@@ -0,0 +1,61 @@
+import glob
+import io
+import os
+import shutil
+
+import ffmpeg
+import librosa
+import numpy as np
+import pytest
+
+from src.audio import SAMPLE_RATE, audio_file_to_tensor
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs the ffmpeg binary")
+
+TEST_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "test-files", "*.m4a")))
+
+
+def reference_audio(fname: str) -> np.ndarray:
+    """The original decode: ffmpeg to an in-memory WAV, resampled and mixed down to mono by librosa"""
+    wav_bytes, _ = ffmpeg.input(fname).output("pipe:1", format="wav").run(capture_stdout=True, capture_stderr=True)
+    audio, _ = librosa.load(io.BytesIO(wav_bytes), sr=SAMPLE_RATE, mono=True)
+    return audio
+
+
+def synthesize(path: str, channels: str, layout: str = "") -> str:
+    source = f"aevalsrc={channels}{':c=' + layout if layout else ''}:s=44100:d=3"
+    ffmpeg.input(source, f="lavfi").output(path).run(quiet=True, overwrite_output=True)
+    return path
+
+
+def assert_matches_reference(fname: str) -> None:
+    expected = reference_audio(fname)
+    audio, duration = audio_file_to_tensor(fname)
+
+    assert audio.shape == (1, len(expected))
+    assert duration == pytest.approx(len(expected) / SAMPLE_RATE)
+    # ffmpeg and librosa resample differently, anything above that, like a change of gain, is an error
+    error = np.sqrt(np.mean((audio.numpy()[0] - expected) ** 2))
+    assert error < 0.03 * np.sqrt(np.mean(expected ** 2))
+
+
+@pytest.mark.parametrize("fname", TEST_FILES)
+def test_matches_librosa(fname):
+    assert_matches_reference(fname)
+
+
+def test_stereo_is_averaged(tmp_path):
+    assert_matches_reference(synthesize(str(tmp_path / "stereo.m4a"), "sin(440*2*PI*t)|0.5*sin(660*2*PI*t)"))
+
+
+def test_surround_is_averaged(tmp_path):
+    channels = "|".join(f"0.3*sin({200 + 100 * i}*2*PI*t)" for i in range(6))
+    assert_matches_reference(synthesize(str(tmp_path / "surround.m4a"), channels, layout="5.1"))
+
+
+def test_file_without_audio_fails(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    ffmpeg.input("testsrc=d=1", f="lavfi").output(path, vcodec="mpeg4").run(quiet=True, overwrite_output=True)
+
+    with pytest.raises(Exception, match="ffmpeg error"):
+        audio_file_to_tensor(path)
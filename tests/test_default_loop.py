@@ -0,0 +1,170 @@
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import asdict
+from typing import Dict, Iterator, List
+
+from hypothesis import given, strategies as st
+
+from src.default_loop import MessageWriter, encode_message, next_batch, start_loop_from_producer
+from src.message_producer import (
+    Error, ErrorMessage, Message, Progress, ProgressMessage, Tag, TagMessage, TagMessageProducer,
+)
+
+
+class StubTagProducer(TagMessageProducer):
+    """Yields one tag and a progress message per file, recording when each file got its tag"""
+
+    def __init__(self):
+        self.tagged: Dict[str, float] = {}
+        self.batches: List[List[str]] = []
+        self.tag_event = threading.Event()
+
+    def produce(self, files: List[str]) -> Iterator[Message]:
+        self.batches.append(list(files))
+        for fname in files:
+            self.tagged[fname] = time.monotonic()
+            self.tag_event.set()
+            yield TagMessage(type="tag", data=Tag(start_time=0, end_time=1000, tag="stub", source_media=fname))
+            yield ProgressMessage(type="progress", data=Progress(source_media=fname))
+
+
+def test_lone_file_is_returned_without_waiting():
+    file_queue = queue.Queue()
+    file_queue.put("a.m4a")
+
+    start = time.monotonic()
+    assert next_batch(file_queue, batch_limit=8) == (["a.m4a"], False)
+    assert time.monotonic() - start < 0.05
+
+
+def test_waits_for_the_first_file():
+    file_queue = queue.Queue()
+    threading.Timer(0.1, file_queue.put, args=["a.m4a"]).start()
+
+    assert next_batch(file_queue, batch_limit=8) == (["a.m4a"], False)
+
+
+def test_burst_is_capped_at_batch_limit():
+    file_queue = queue.Queue()
+    files = [f"{i}.m4a" for i in range(20)]
+    for fname in files:
+        file_queue.put(fname)
+    file_queue.put(None)
+
+    assert next_batch(file_queue, batch_limit=8) == (files[:8], False)
+    assert next_batch(file_queue, batch_limit=8) == (files[8:16], False)
+    # the queue was closed right behind the last files
+    assert next_batch(file_queue, batch_limit=8) == (files[16:], True)
+
+
+def test_closed_queue_is_done():
+    file_queue = queue.Queue()
+    file_queue.put(None)
+
+    assert next_batch(file_queue) == ([], True)
+
+
+def test_live_loop_tags_a_lone_file_right_away(tmp_path, monkeypatch):
+    producer = StubTagProducer()
+    read_fd, write_fd = os.pipe()
+    monkeypatch.setattr(sys, "stdin", os.fdopen(read_fd, "r"))
+    output_path = str(tmp_path / "tags.jsonl")
+    loop = threading.Thread(target=start_loop_from_producer, args=(producer, output_path), kwargs={"batch_limit": 8})
+    loop.start()
+
+    latencies = []
+    with os.fdopen(write_fd, "w", buffering=1) as stdin:
+        # one file at a time, each written once the previous one was tagged, so no file has company to wait for
+        for i in range(5):
+            fname = f"{i}.m4a"
+            producer.tag_event.clear()
+            enqueued = time.monotonic()
+            stdin.write(fname + "\n")
+            assert producer.tag_event.wait(timeout=10)
+            latencies.append(producer.tagged[fname] - enqueued)
+    loop.join(timeout=10)
+
+    assert not loop.is_alive()
+    assert producer.batches == [[f"{i}.m4a"] for i in range(5)]
+    assert sorted(latencies)[len(latencies) // 2] < 0.1
+    with open(output_path) as f:
+        assert len(f.readlines()) == 10
+
+
+def reference_encode(msg: Message) -> str:
+    """The original write_message line, built with asdict and json.dumps"""
+    return json.dumps({"type": msg.type, "data": asdict(msg.data)}) + "\n"
+
+
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False) | st.text(),
+    lambda children: st.lists(children, max_size=3) | st.dictionaries(st.text(), children, max_size=3),
+    max_leaves=8,
+)
+messages = st.one_of(
+    st.builds(
+        TagMessage,
+        type=st.just("tag"),
+        data=st.builds(
+            Tag,
+            start_time=st.integers(0, 10 ** 9),
+            end_time=st.integers(0, 10 ** 9),
+            tag=st.text(),
+            source_media=st.text(),
+            track=st.sampled_from(["", "speech_to_text", "auto_captions"]),
+            additional_info=st.none() | st.dictionaries(st.text(), json_values, max_size=3),
+        ),
+    ),
+    st.builds(ProgressMessage, type=st.just("progress"), data=st.builds(Progress, source_media=st.text())),
+    st.builds(
+        ErrorMessage,
+        type=st.just("error"),
+        data=st.builds(Error, message=st.text(), source_media=st.none() | st.text()),
+    ),
+)
+
+
+@given(messages)
+def test_encode_message_matches_the_reference(msg):
+    assert encode_message(msg) == reference_encode(msg)
+
+
+@given(st.lists(messages, max_size=20))
+def test_writer_output_matches_the_reference(msgs):
+    fout = io.StringIO()
+    writer = MessageWriter(fout)
+    for msg in msgs:
+        writer.write(msg)
+    writer.end_batch()
+
+    assert fout.getvalue() == "".join(reference_encode(msg) for msg in msgs)
+
+
+def test_writer_holds_tags_until_progress():
+    fout = io.StringIO()
+    writer = MessageWriter(fout)
+    tags = [TagMessage(type="tag", data=Tag(i * 400, i * 400 + 320, f"w{i}", "a.m4a")) for i in range(3)]
+    for tag in tags:
+        writer.write(tag)
+    assert fout.getvalue() == ""
+
+    writer.write(ProgressMessage(type="progress", data=Progress(source_media="a.m4a")))
+    assert fout.getvalue().count("\n") == 4
+
+
+def test_writer_flushes_a_full_buffer():
+    fout = io.StringIO()
+    writer = MessageWriter(fout, max_buffer=100)
+    tag = TagMessage(type="tag", data=Tag(0, 320, "word", "a.m4a"))
+    line = encode_message(tag)
+    for _ in range(100 // len(line)):
+        writer.write(tag)
+    assert fout.getvalue() == ""
+
+    writer.write(tag)
+    assert fout.getvalue() == line * (100 // len(line) + 1)
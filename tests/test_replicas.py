@@ -0,0 +1,83 @@
+import os
+import signal
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from src.replicas import ReplicaPool
+
+# load and run are imported by name in the spawned replicas, so they live at module level
+
+
+def load(device):
+    marker = os.environ.get("REPLICA_TEST_DIED")
+    if marker and os.path.exists(marker):
+        raise ValueError("cannot load again")
+    return device
+
+
+def run(model, payload):
+    if payload == "die":
+        marker = os.environ.get("REPLICA_TEST_DIED")
+        if marker:
+            open(marker, "w").close()
+        os._exit(3)
+    time.sleep(0.3 if payload == "slow" else 0.02)
+    return payload * 2
+
+
+def outcomes(futures):
+    done, not_done = wait(futures, timeout=60)
+    assert not not_done, "a task never finished"
+    return [f.exception() if f.exception() is not None else f.result() for f in futures]
+
+
+@pytest.fixture
+def pool():
+    pool = ReplicaPool(["cpu", "cpu"], load, run)
+    yield pool
+    pool.close()
+
+
+def test_only_the_task_of_a_dead_replica_fails(pool):
+    futures = [pool.submit(i) for i in range(6)] + [pool.submit("die")] + [pool.submit(i) for i in range(6, 12)]
+    results = outcomes(futures)
+
+    assert results[:6] + results[7:] == [2 * i for i in range(12)]
+    assert isinstance(results[6], RuntimeError) and "exited unexpectedly" in str(results[6])
+    # the replica is started again and takes tasks
+    assert outcomes([pool.submit(i) for i in range(4)]) == [0, 2, 4, 6]
+    assert len(pool) == 2
+
+
+@pytest.mark.parametrize("delay", [0.0, 0.15])
+def test_killed_replica_fails_at_most_its_task(pool, delay):
+    # killed right after the tasks were handed out, before or after the replica took its task from its queue
+    futures = [pool.submit("slow") for _ in range(6)]
+    time.sleep(delay)
+    os.kill(pool.processes[0].pid, signal.SIGKILL)
+    results = outcomes(futures)
+
+    failed = [r for r in results if isinstance(r, Exception)]
+    assert len(failed) <= 1
+    assert results.count("slowslow") == len(results) - len(failed)
+    assert outcomes([pool.submit(i) for i in range(4)]) == [0, 2, 4, 6]
+
+
+def test_replica_that_cannot_load_again_is_dropped(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPLICA_TEST_DIED", str(tmp_path / "died"))
+    pool = ReplicaPool(["cpu", "cpu"], load, run)
+    try:
+        results = outcomes([pool.submit("die")] + [pool.submit(i) for i in range(4)])
+        assert isinstance(results[0], RuntimeError)
+        assert results[1:] == [0, 2, 4, 6]
+
+        deadline = time.monotonic() + 60
+        while len(pool) == 2 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        # only the live replica counts toward the batches kept in flight
+        assert len(pool) == 1
+        assert outcomes([pool.submit(i) for i in range(4)]) == [0, 2, 4, 6]
+    finally:
+        pool.close()
@@ -0,0 +1,76 @@
+import itertools
+from typing import List, Tuple
+
+import pytest
+import torch
+from hypothesis import given, settings, strategies as st
+
+from benchmarks.stubs import StubASRModel, VOCABULARY
+from src.stt import EnglishSTT, FRAME_SIZE, TOKEN_OFFSET
+
+
+def reference_word_timestamps(
+    stt: EnglishSTT,
+    beams: torch.Tensor,
+    timesteps: torch.Tensor,
+    out_lens: torch.Tensor,
+) -> Tuple[str, List[Tuple[float, float]]]:
+    """The original per-token loops of _beamsearch_batch and _get_word_level_timestamps"""
+    seq_length = out_lens[0][0].item()
+    item_timesteps = (timesteps[0][0][:seq_length] * FRAME_SIZE).tolist()
+    best_candidate = beams[0][0][:seq_length].tolist()
+    proxy_chars_seq = [stt.decoder._labels[idx] for idx in best_candidate]
+    converted_best_candidate = [ord(c) - TOKEN_OFFSET for c in proxy_chars_seq]
+    tokens = stt.ids_to_tokens_func(converted_best_candidate)
+    pred_text = stt.ids_to_text_func(converted_best_candidate)
+
+    timestamps = [t * 1000 for t in item_timesteps]
+    for i in range(1, len(timestamps)):
+        timestamps[i] = max(timestamps[i], timestamps[i - 1])
+    frame_size = FRAME_SIZE * 1000
+    word_timestamps = []
+    current_start = None
+    current_end = None
+    for ts, tok in zip(timestamps, tokens):
+        if tok.startswith('▁'):
+            if current_start is not None:
+                word_timestamps.append((current_start, current_end + frame_size))
+            current_start = ts
+        current_end = ts
+    if current_start is not None:
+        word_timestamps.append((current_start, current_end + frame_size))
+    return pred_text, word_timestamps
+
+
+@pytest.fixture(scope="module")
+def stt():
+    return EnglishSTT(None, None, device='cpu', model=StubASRModel())
+
+
+# token ids and the frames between each token and the one before, the decoder occasionally reports a frame earlier
+# than the previous one
+beam_tokens = st.lists(
+    st.tuples(st.integers(0, len(VOCABULARY) - 1), st.integers(-2, 10)),
+    max_size=200,
+)
+
+
+@settings(deadline=None)
+@given(beam_tokens)
+def test_word_timestamps_match_the_reference(stt, tokens):
+    token_ids = torch.IntTensor([token for token, _ in tokens])
+    frames = torch.IntTensor(list(itertools.accumulate(step for _, step in tokens))).clamp(min=0)
+    decoded = (
+        token_ids.view(1, 1, -1),
+        torch.zeros(1, 1),
+        frames.view(1, 1, -1),
+        torch.IntTensor([[len(tokens)]]),
+    )
+    stt.decoder.decode = lambda batch, seq_lens: decoded
+    # decode is stubbed out, so the probs only need the right rank
+    probs = torch.zeros(1, 1, len(stt.word_start))
+
+    pred_text, _, timesteps, ids = stt._beamsearch(probs)
+    word_timestamps = stt._get_word_level_timestamps(timesteps, ids, FRAME_SIZE * 1000)
+
+    assert (pred_text, word_timestamps) == reference_word_timestamps(stt, *[decoded[i] for i in (0, 2, 3)])
@@ -0,0 +1,115 @@
+from typing import List, Tuple
+
+from hypothesis import given, settings, strategies as st
+from num2words import num2words
+from word2number import w2n
+
+from src.utils import postprocess
+
+WORDS = [
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve", "twenty",
+    "thirty", "forty", "fifty", "sixty", "ninety", "hundred", "thousand", "million", "billion", "point", "zero",
+    "and", "th", "nd", "the", "year", "in", "was", "born", "of", "a", "d", "twenty-one", "1964", "42",
+]
+NUMERIC_RUNS = [
+    "one thousand nine hundred and sixty four",
+    "two thousand and twelve",
+    "nineteen hundred and fifty",
+    "five th",
+    "twenty nd",
+    "one million two hundred thousand and three",
+    "one point five",
+]
+
+
+def reference_postprocess(transcript: str, timesteps: list) -> Tuple[str, list]:
+    """The original utils.postprocess, which checks every prefix of a phrase word by word"""
+    def is_numeric_word(w):
+        try:
+            w2n.word_to_num(w)
+        except Exception:
+            return False
+        return True
+
+    def is_numeric_phrase(p):
+        try:
+            for item in p:
+                if not is_numeric_word(item) and not item == "and":
+                    return False
+            w2n.word_to_num(' '.join(p))
+        except Exception:
+            return False
+        return True
+
+    transcript = transcript.split()
+    timesteps = timesteps[:]
+    min_year = 1100
+    max_year = 2500
+    min_date_phrase_length = 4
+
+    seek = 1
+    idx = 0
+    while idx < len(transcript):
+        if is_numeric_word(transcript[idx]):
+            while idx+seek <= len(transcript) and is_numeric_phrase(transcript[idx:idx+seek]):
+                seek = seek+1
+            seek -= 1
+            while seek > 2 and transcript[idx+seek-1] == "and":
+                seek -= 1
+            as_number = w2n.word_to_num(' '.join(transcript[idx:idx+seek]))
+            if seek > min_date_phrase_length and min_year < as_number < max_year:
+                transcript[idx] = as_number
+                del transcript[idx+1:idx+seek]
+                del timesteps[idx+1:idx+seek]
+                seek = 1
+        idx, seek = idx+seek, 1
+
+    ordinal_suffixes = ["th", "nd"]
+    idx = 0
+    while idx < len(transcript)-1:
+        if is_numeric_word(transcript[idx]) and transcript[idx+1] in ordinal_suffixes:
+            transcript[idx] = num2words(w2n.word_to_num(transcript[idx]), to="ordinal")
+            transcript.pop(idx+1)
+            timesteps.pop(idx+1)
+        idx += 1
+
+    transcript = list(map(str, transcript))
+
+    return ' '.join(transcript), timesteps
+
+
+def timesteps_for(words: List[str]) -> List[Tuple[int, int]]:
+    return [(40 * i, 40 * i + 40) for i in range(len(words))]
+
+
+def test_year_phrase_becomes_a_number():
+    words = "he was born in one thousand nine hundred and sixty four in".split()
+    transcript, timesteps = postprocess(' '.join(words), timesteps_for(words))
+
+    assert transcript == "he was born in 1964 in"
+    # the year keeps the timestep of its first word
+    assert timesteps == timesteps_for(words)[:5] + timesteps_for(words)[-1:]
+
+
+def test_short_numbers_and_non_years_are_kept():
+    for text in ["two thousand and twelve", "one million two hundred thousand and three", "nineteen hundred"]:
+        words = text.split()
+        assert postprocess(text, timesteps_for(words)) == (text, timesteps_for(words))
+
+
+def test_ordinal_suffix_is_joined():
+    words = "the five th of june".split()
+    assert postprocess(' '.join(words), timesteps_for(words))[0] == "the fifth of june"
+
+
+numeric_text = st.lists(
+    st.one_of(st.sampled_from(WORDS).map(lambda word: [word]), st.sampled_from(NUMERIC_RUNS).map(str.split)),
+    max_size=30,
+).map(lambda chunks: [word for chunk in chunks for word in chunk])
+
+
+@settings(deadline=None)
+@given(numeric_text)
+def test_postprocess_matches_the_reference(words):
+    transcript, timesteps = ' '.join(words), timesteps_for(words)
+    assert postprocess(transcript, timesteps) == reference_postprocess(transcript, timesteps)